@@ -2,3 +2,13 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from django.core.signals import request_started
+        from django.db.backends.signals import connection_created
+
+        from .database import apply_sqlite_pragmas, check_connections, track_connection_use
+
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid='api.apply_sqlite_pragmas')
+        connection_created.connect(track_connection_use, dispatch_uid='api.track_connection_use')
+        request_started.connect(check_connections, dispatch_uid='api.check_connections')
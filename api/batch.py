@@ -0,0 +1,338 @@
+from django.db import IntegrityError, connection, transaction
+
+from .deletion import delete_trees
+from .models import Parameter, Script, Stage, Task
+from .tracking import log_changes, touch_scripts
+
+# model name -> (model, parent field, parent model name)
+MODELS = {
+    'script': (Script, 'owner_id', None),
+    'stage': (Stage, 'script_id', 'script'),
+    'task': (Task, 'stage_id', 'stage'),
+    'parameter': (Parameter, 'task_id', 'task'),
+}
+
+FIELDS = {
+    'script': ('title',),
+    'stage': ('name', 'order', 'script_id'),
+    'task': ('name', 'stage_id'),
+    'parameter': ('name', 'value', 'task_id'),
+}
+
+ACTIONS = ('create', 'save', 'remove')
+
+# model name -> lookup leaving out the objects under soft-deleted scripts
+LIVE = {
+    'script': {},
+    'stage': {'script__deleted': False},
+    'task': {'stage__script__deleted': False},
+    'parameter': {'task__stage__script__deleted': False},
+}
+
+
+def _is_scalar(value):
+    return isinstance(value, (str, int, float)) and not isinstance(value, bool)
+
+
+class BatchError(Exception):
+    def __init__(self, index, message, status=400):
+        super().__init__(message)
+        self.index = index
+        self.status = status
+
+
+class Batch:
+    """Apply an ordered list of create/save/remove operations.
+
+    Consecutive operations with the same action and model are applied
+    together, so a run of saves is one bulk_update and a run of removes is
+    one DELETE. Objects created with a ``temp_id`` can be referenced by
+    later operations in place of their real id.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.results = []
+        self.temp_ids = {}
+        self.object_scripts = {}
+        self.touched_script_ids = set()
+        self.changed_task_ids = set()
+        self.changed_stage_ids = set()
+        self.stage_list_script_ids = set()
+        self.removed_tasks = set()
+        self.pending_key = None
+        self.pending = []
+
+    def add(self, index, operation):
+        if not isinstance(operation, dict):
+            raise BatchError(index, 'Incorrect operation')
+
+        action = operation.get('action')
+        model_name = operation.get('model')
+        if action not in ACTIONS:
+            raise BatchError(index, 'Incorrect action')
+        if model_name not in MODELS:
+            raise BatchError(index, 'Incorrect model')
+
+        fields = operation.get('fields') or {}
+        if not isinstance(fields, dict) or not set(fields) <= set(FIELDS[model_name]):
+            raise BatchError(index, 'Incorrect fields')
+
+        temp_id = operation.get('temp_id')
+        if temp_id is not None and not _is_scalar(temp_id):
+            raise BatchError(index, 'Incorrect data type temp_id')
+
+        if (action, model_name) != self.pending_key:
+            self.flush()
+            self.pending_key = (action, model_name)
+        self.pending.append((index, operation, fields))
+        self.results.append(None)
+
+    def flush(self):
+        if not self.pending:
+            return
+        action, model_name = self.pending_key
+        apply = getattr(self, '_%s' % action)
+        try:
+            with transaction.atomic():
+                apply(model_name, self.pending)
+        except IntegrityError:
+            self._raise_conflict(apply, model_name)
+        self.pending_key = None
+        self.pending = []
+
+    def _raise_conflict(self, apply, model_name):
+        """Replay the failed run one operation at a time to report the one that conflicts."""
+        for item in self.pending:
+            try:
+                with transaction.atomic():
+                    apply(model_name, [item])
+            except IntegrityError:
+                raise BatchError(item[0], 'This name is already in use')
+        raise BatchError(self.pending[0][0], 'This name is already in use')
+
+    def _resolve(self, index, model_name, value):
+        if isinstance(value, str) and value in self.temp_ids:
+            temp_model_name, object_id = self.temp_ids[value]
+            if temp_model_name != model_name:
+                raise BatchError(index, 'Incorrect %s id' % model_name)
+            return object_id
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise BatchError(index, 'Incorrect data type %s id' % model_name)
+
+    def _clean(self, index, model_name, fields, required):
+        cleaned = {}
+        for field in FIELDS[model_name]:
+            if field not in fields:
+                if required and field != 'value':
+                    raise BatchError(index, 'Missing field')
+                continue
+            value = fields[field]
+            if not _is_scalar(value) and not (field == 'value' and value is None):
+                raise BatchError(index, 'Incorrect data type %s' % field)
+            if field == 'value':
+                value = '' if value is None else str(value)
+            elif not value and value != 0:
+                raise BatchError(index, 'Missing field')
+            elif field == 'order':
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    raise BatchError(index, 'Incorrect data type order stage')
+                if value < 0:
+                    raise BatchError(index, 'Order stage cant be negative')
+            elif field.endswith('_id'):
+                value = self._resolve(index, field[:-len('_id')], value)
+            else:
+                value = str(value)
+            cleaned[field] = value
+        return cleaned
+
+    def _parent_scripts(self, model_name, items):
+        """Check the parents referenced by ``items`` and map them to their script ids."""
+        _, parent_field, parent_name = MODELS[model_name]
+        parent_ids = {fields[parent_field] for _, fields in items if parent_field in fields}
+        scripts = {
+            parent_id: self.object_scripts[(parent_name, parent_id)]
+            for parent_id in parent_ids
+            if (parent_name, parent_id) in self.object_scripts
+        }
+
+        missing_ids = parent_ids - set(scripts)
+        if missing_ids:
+            if parent_name == 'script':
+                rows = Script.objects.filter(id__in=missing_ids).values_list('id', 'id')
+            elif parent_name == 'stage':
+                rows = Stage.objects.filter(id__in=missing_ids, **LIVE['stage']).values_list('id', 'script_id')
+            else:
+                rows = Task.objects.filter(id__in=missing_ids, **LIVE['task']).values_list('id', 'stage__script_id')
+            scripts.update(rows)
+
+        for index, fields in items:
+            if parent_field in fields and fields[parent_field] not in scripts:
+                raise BatchError(index, 'Incorrect %s id' % parent_name, status=404)
+        return scripts
+
+    def _load(self, model_name, pending):
+        model = MODELS[model_name][0]
+        object_ids = [
+            (index, self._resolve(index, model_name, operation.get('id')))
+            for index, operation, _ in pending
+        ]
+
+        queryset = model.objects.filter(**LIVE[model_name])
+        if model_name == 'task':
+            queryset = queryset.select_related('stage')
+        elif model_name == 'parameter':
+            queryset = queryset.select_related('task__stage')
+        objects = queryset.in_bulk({object_id for _, object_id in object_ids})
+
+        loaded = []
+        for index, object_id in object_ids:
+            if object_id not in objects:
+                raise BatchError(index, 'Incorrect %s id' % model_name, status=404)
+            loaded.append(objects[object_id])
+        return loaded
+
+    def _script_id(self, model_name, obj):
+        if model_name == 'script':
+            return obj.id
+        if model_name == 'stage':
+            return obj.script_id
+        if model_name == 'task':
+            return obj.stage.script_id
+        return obj.task.stage.script_id
+
+    def _create(self, model_name, pending):
+        model, parent_field, _ = MODELS[model_name]
+        items = [(index, self._clean(index, model_name, fields, True)) for index, _, fields in pending]
+        if model_name == 'script':
+            for _, fields in items:
+                fields['owner_id'] = self.user.id
+            parent_scripts = {}
+        else:
+            parent_scripts = self._parent_scripts(model_name, items)
+
+        objects = [model(**fields) for _, fields in items]
+        if model_name == 'parameter':
+            for obj in objects:
+                obj.update_parsed()
+        if connection.features.can_return_ids_from_bulk_insert:
+            model.objects.bulk_create(objects)
+        else:
+            for obj in objects:
+                obj.save()
+
+        changes = []
+        for (index, operation, _), obj in zip(pending, objects):
+            if model_name == 'script':
+                script_id = obj.id
+            else:
+                script_id = parent_scripts[getattr(obj, parent_field)]
+            self.object_scripts[(model_name, obj.id)] = script_id
+            self.touched_script_ids.add(script_id)
+            self._track_change(model_name, obj, script_id)
+            changes.append((script_id, model_name, obj.id, 'create'))
+
+            temp_id = operation.get('temp_id')
+            if temp_id is not None:
+                self.temp_ids[str(temp_id)] = (model_name, obj.id)
+            self.results[index] = {'id': obj.id, 'temp_id': temp_id}
+        log_changes(*changes)
+
+    def _save(self, model_name, pending):
+        model, parent_field, _ = MODELS[model_name]
+        items = [(index, self._clean(index, model_name, fields, False)) for index, _, fields in pending]
+        parent_scripts = {} if model_name == 'script' else self._parent_scripts(model_name, items)
+        objects = self._load(model_name, pending)
+
+        updated_fields = set()
+        moved_stages = {}
+        changes = []
+        for (index, fields), obj in zip(items, objects):
+            old_script_id = self._script_id(model_name, obj)
+            new_script_id = parent_scripts[fields[parent_field]] if parent_field in fields else old_script_id
+            self.touched_script_ids.update((old_script_id, new_script_id))
+            changes.extend((script_id, model_name, obj.id, 'save') for script_id in (old_script_id, new_script_id))
+
+            old_name = getattr(obj, 'name', None)
+            self._track_change(model_name, obj, old_script_id)
+            for field, value in fields.items():
+                setattr(obj, field, value)
+            updated_fields.update(fields)
+            self._track_change(model_name, obj, new_script_id)
+
+            renamed = old_name != getattr(obj, 'name', None) or old_script_id != new_script_id
+            if model_name == 'stage' and renamed:
+                self.changed_stage_ids.add(obj.id)
+                if old_script_id != new_script_id:
+                    moved_stages[obj.id] = old_script_id
+            elif model_name == 'task' and renamed:
+                self.removed_tasks.add((old_script_id, old_name))
+            self.results[index] = {'id': obj.id}
+
+        self._track_removed_tasks(moved_stages)
+
+        if model_name == 'parameter' and updated_fields & {'name', 'value'}:
+            for obj in objects:
+                obj.update_parsed()
+            updated_fields.add('parsed')
+        if updated_fields:
+            model.objects.bulk_update(set(objects), sorted(updated_fields))
+        log_changes(*changes)
+
+    def _remove(self, model_name, pending):
+        model = MODELS[model_name][0]
+        objects = self._load(model_name, pending)
+
+        removed_stages = {}
+        changes = []
+        for (index, _, _), obj in zip(pending, objects):
+            script_id = self._script_id(model_name, obj)
+            self.touched_script_ids.add(script_id)
+            changes.append((script_id, model_name, obj.id, 'remove'))
+            if model_name == 'stage':
+                self.stage_list_script_ids.add(script_id)
+                removed_stages[obj.id] = script_id
+            elif model_name == 'task':
+                self.removed_tasks.add((script_id, obj.name))
+            elif model_name == 'parameter':
+                self.changed_task_ids.add(obj.task_id)
+            self.results[index] = {'id': obj.id}
+
+        self._track_removed_tasks(removed_stages)
+        log_changes(*changes)
+        delete_trees(model, {obj.id for obj in objects})
+
+    def _track_change(self, model_name, obj, script_id):
+        """Remember what a created or saved object changes in the export of its script."""
+        if model_name == 'stage':
+            self.stage_list_script_ids.add(script_id)
+        elif model_name == 'task':
+            self.changed_task_ids.add(obj.id)
+        elif model_name == 'parameter':
+            self.changed_task_ids.add(obj.task_id)
+
+    def _track_removed_tasks(self, stage_scripts):
+        """Record tombstones for the tasks of stages leaving the scripts in ``stage_scripts``."""
+        if stage_scripts:
+            rows = Task.objects.filter(stage_id__in=stage_scripts).values_list('stage_id', 'name')
+            self.removed_tasks.update((stage_scripts[stage_id], name) for stage_id, name in rows)
+
+
+def apply_operations(user, operations):
+    """Apply ``operations`` in one transaction and return the per-operation results.
+
+    Raises BatchError, with nothing applied, if any operation fails.
+    """
+    batch = Batch(user)
+    with transaction.atomic():
+        for index, operation in enumerate(operations):
+            batch.add(index, operation)
+        batch.flush()
+        touch_scripts(
+            *batch.touched_script_ids, tasks=batch.changed_task_ids, stages=batch.changed_stage_ids,
+            stage_lists=batch.stage_list_script_ids, removed_tasks=batch.removed_tasks)
+    return batch.results
@@ -0,0 +1,132 @@
+import random
+import time
+from contextlib import contextmanager
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test.utils import (
+    setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+from django.utils.crypto import get_random_string
+
+from .bulk import bulk_create_with_ids
+from .models import Parameter, Script, Stage, Task
+from .search import index_objects
+
+SCRIPT_COMMANDS = [
+    'npm ci',
+    'npm run build -- --env production',
+    'npm test -- --coverage',
+    'pip install -r requirements.txt',
+    'python manage.py test',
+    'docker build -t $CI_REGISTRY_IMAGE:$CI_COMMIT_SHA .',
+    'docker push $CI_REGISTRY_IMAGE:$CI_COMMIT_SHA',
+    './scripts/deploy.sh staging',
+    'make -j4 all',
+    'echo "Done"',
+]
+
+ONLY_REFS = ['master', 'develop', 'tags', 'merge_requests', 'schedules', 'web']
+
+PARAMETER_VALUES = {
+    'image': ['node:12', 'python:3.8', 'docker:19.03', 'alpine:latest'],
+    'when': ['on_success', 'manual', 'always'],
+    'tags': ['docker', 'shell', 'linux'],
+    'allow_failure': ['true', 'false'],
+}
+
+PARAMETER_NAMES = ['script', 'only'] + sorted(PARAMETER_VALUES)
+
+STAGE_NAMES = ['build', 'test', 'lint', 'package', 'deploy', 'cleanup']
+
+SEED_CHUNK_SIZE = 10000
+
+
+@contextmanager
+def benchmark_database(verbosity=0):
+    setup_test_environment(debug=False)
+    old_config = setup_databases(verbosity, interactive=False)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity)
+        teardown_test_environment()
+
+
+def requests_per_second(send_request, count):
+    started = time.perf_counter()
+    for _ in range(count):
+        response = send_request()
+        if response.status_code != 200:
+            raise RuntimeError('Unexpected status %d' % response.status_code)
+    return count / (time.perf_counter() - started)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _parameter_value(rnd, name):
+    if name == 'script':
+        return '\r\n'.join(rnd.sample(SCRIPT_COMMANDS, rnd.randint(2, 6)))
+    if name == 'only':
+        return rnd.choice([' ', ';', ', ']).join(rnd.sample(ONLY_REFS, rnd.randint(1, 3)))
+    if name in PARAMETER_VALUES:
+        return rnd.choice(PARAMETER_VALUES[name])
+    return 'value-%d' % rnd.randint(0, 1000)
+
+
+def seed_database(users, scripts, stages, tasks, parameters, password, seed=0):
+    """Fill the database with synthetic pipelines and return the new users.
+
+    Counts other than ``users`` are per parent: every user gets ``scripts``
+    scripts, every script ``stages`` stages and so on.
+    """
+    rnd = random.Random(seed)
+    prefix = get_random_string(6).lower()
+    password_hash = make_password(password)
+
+    with transaction.atomic():
+        new_users = bulk_create_with_ids(User, [
+            User(username='%s-%d@example.com' % (prefix, index),
+                 email='%s-%d@example.com' % (prefix, index),
+                 password=password_hash)
+            for index in range(users)
+        ], ('username',))
+
+        new_scripts = bulk_create_with_ids(Script, [
+            Script(title='pipeline-%d' % index, owner_id=user.id)
+            for user in new_users for index in range(scripts)
+        ], ('owner_id', 'title'))
+
+        new_stages = bulk_create_with_ids(Stage, [
+            Stage(name='%s-%d' % (STAGE_NAMES[index % len(STAGE_NAMES)], index), order=index, script_id=script.id)
+            for script in new_scripts for index in range(stages)
+        ], ('script_id', 'name'))
+
+        new_tasks = bulk_create_with_ids(Task, [
+            Task(name='%s-job-%d' % (stage.name, index), stage_id=stage.id)
+            for stage in new_stages for index in range(tasks)
+        ], ('stage_id', 'name'))
+
+        names = PARAMETER_NAMES + ['param-%d' % index for index in range(len(PARAMETER_NAMES), parameters)]
+        new_parameters = (
+            Parameter(name=name, value=_parameter_value(rnd, name), task_id=task.id)
+            for task in new_tasks for name in names[:parameters]
+        )
+        while True:
+            chunk = list(islice(new_parameters, SEED_CHUNK_SIZE))
+            if not chunk:
+                break
+            for parameter in chunk:
+                parameter.update_parsed()
+            Parameter.objects.bulk_create(chunk)
+
+        index_objects('script', [script.id for script in new_scripts])
+
+    return new_users
@@ -0,0 +1,29 @@
+from django.db import connection
+
+
+def bulk_create_with_ids(model, objects, key_fields):
+    """bulk_create ``objects`` and make sure every one of them has its id set.
+
+    Backends that cannot return ids from a bulk insert (SQLite) get them
+    read back by ``key_fields``, which must be unique together; the rows
+    are looked up by the first of them, usually the parent foreign key.
+    """
+    model.objects.bulk_create(objects)
+    if connection.features.can_return_ids_from_bulk_insert or not objects:
+        return objects
+
+    parent_field = key_fields[0]
+    parent_ids = list({getattr(obj, parent_field) for obj in objects})
+    batch_size = connection.ops.bulk_batch_size([parent_field], parent_ids) or len(parent_ids)
+
+    ids = {}
+    for start in range(0, len(parent_ids), batch_size):
+        rows = model.objects.filter(**{
+            '%s__in' % parent_field: parent_ids[start:start + batch_size],
+        }).values_list(*key_fields, 'id')
+        for row in rows.iterator():
+            ids[row[:-1]] = row[-1]
+
+    for obj in objects:
+        obj.id = ids[tuple(getattr(obj, field) for field in key_fields)]
+    return objects
@@ -0,0 +1,129 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import ChangeLog
+from .pagination import keyset_page
+
+CHANGE_FIELDS = ('id', 'script_id', 'model', 'object_id', 'action')
+
+# Cursors are ChangeLog ids. SQLite commits one write at a time, so ids
+# become visible in order. On PostgreSQL an id is taken at insert but
+# becomes visible at commit, so a change committed after a higher id was
+# read falls behind the cursor of a client that already passed that id,
+# and that client never sees it. Clients that can't afford to miss a
+# change there should resync from a full listing when they reconnect.
+
+_waiters = 0
+_waiters_lock = threading.Lock()
+
+
+def latest_cursor():
+    """Return the cursor of the newest change of any owner, so that it stays ahead of pruning."""
+    return ChangeLog.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def cursor_expired(since):
+    """Tell whether changes after ``since`` may have been pruned from the log."""
+    first_id = ChangeLog.objects.order_by('id').values_list('id', flat=True).first()
+    return first_id is not None and since + 1 < first_id
+
+
+def prune_changes(before):
+    """Delete the changes logged before ``before`` and return how many were deleted.
+
+    The newest change is always kept, so that cursor_expired can still
+    tell an expired cursor from a current one.
+    """
+    with transaction.atomic():
+        newest_id = ChangeLog.objects.order_by('-id').values_list('id', flat=True).first()
+        if newest_id is None:
+            return 0
+        deleted, _ = ChangeLog.objects.filter(created__lt=before, id__lt=newest_id).delete()
+    return deleted
+
+
+def get_changes(user, since):
+    """Return up to a page of the changes of ``user`` after ``since``, the next cursor and whether more follow.
+
+    On an empty page the cursor moves up to the newest change of any
+    owner, read before the page, so that the cursor of an idle client
+    doesn't expire when the changes of other owners are pruned.
+    """
+    head = latest_cursor()
+    changes, next_cursor = keyset_page(
+        ChangeLog.objects.filter(owner=user), CHANGE_FIELDS, since, settings.API_MAX_PAGE_SIZE)
+    cursor = changes[-1]['id'] if changes else max(since, head)
+    return changes, cursor, next_cursor is not None
+
+
+@contextmanager
+def _waiter_slot():
+    """Take one of the CHANGES_MAX_WAITERS slots of the process; yield whether one was free."""
+    global _waiters
+    with _waiters_lock:
+        acquired = _waiters < settings.CHANGES_MAX_WAITERS
+        if acquired:
+            _waiters += 1
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            with _waiters_lock:
+                _waiters -= 1
+
+
+def _poll_changes(user, since, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        changes, cursor, more = get_changes(user, since)
+        remaining = deadline - time.monotonic()
+        if changes or remaining <= 0:
+            return changes, cursor, more
+        time.sleep(min(settings.CHANGES_POLL_INTERVAL, remaining))
+
+
+def wait_for_changes(user, since, timeout):
+    """Poll for changes after ``since`` until there are some or ``timeout`` seconds pass.
+
+    Returns what get_changes returns. Every poll is two index lookups. A
+    waiting request holds a worker thread, so at most CHANGES_MAX_WAITERS
+    requests of the process wait at a time; beyond that None is returned
+    at once if there are no changes yet.
+    """
+    result = get_changes(user, since)
+    if result[0]:
+        return result
+    with _waiter_slot() as acquired:
+        if not acquired:
+            return None
+        return _poll_changes(user, since, timeout)
+
+
+def stream_changes(user, since):
+    """Yield the changes after ``since`` as Server-Sent Events for CHANGES_STREAM_SECONDS.
+
+    Each event carries its cursor as the event id, so a reconnecting
+    EventSource resumes from Last-Event-ID. While idle, an event with only
+    an id and a comment moves the cursor along and keeps proxies from
+    closing the connection. A stream takes a waiter slot
+    for its whole life; without a free one it only tells the client to
+    reconnect after CHANGES_RETRY_AFTER seconds.
+    """
+    with _waiter_slot() as acquired:
+        if not acquired:
+            yield 'retry: %d\n\n' % (settings.CHANGES_RETRY_AFTER * 1000)
+            return
+
+        deadline = time.monotonic() + settings.CHANGES_STREAM_SECONDS
+        while time.monotonic() < deadline:
+            changes, since, _ = _poll_changes(
+                user, since, min(settings.CHANGES_MAX_WAIT, deadline - time.monotonic()))
+            if not changes:
+                yield 'id: %d\n: keepalive\n\n' % since
+            for change in changes:
+                yield 'id: %d\nevent: change\ndata: %s\n\n' % (change['id'], json.dumps(change))
@@ -0,0 +1,36 @@
+from django.db import transaction
+
+from .bulk import bulk_create_with_ids
+from .loaders import load_script_tree
+from .models import Parameter, Script, Stage, Task
+
+
+def copy_script(script, owner, title):
+    """Copy ``script`` with all its stages, tasks and parameters under ``title``.
+
+    The tree is read with the loader and written with one bulk_create per
+    level, all in one transaction. IntegrityError is raised when ``owner``
+    already has a script with that title.
+    """
+    stages = load_script_tree(script)
+
+    with transaction.atomic():
+        clone = Script.objects.create(title=title, owner=owner)
+        new_stages = bulk_create_with_ids(Stage, [
+            Stage(name=stage.name, order=stage.order, script_id=clone.id) for stage in stages
+        ], ('script_id', 'name'))
+
+        tasks = [task for stage in stages for task in stage.tasks]
+        new_tasks = bulk_create_with_ids(Task, [
+            Task(name=task.name, stage_id=new_stage.id)
+            for stage, new_stage in zip(stages, new_stages)
+            for task in stage.tasks
+        ], ('stage_id', 'name'))
+
+        Parameter.objects.bulk_create([
+            Parameter(name=parameter.name, value=parameter.value, parsed=parameter.parsed, task_id=new_task.id)
+            for task, new_task in zip(tasks, new_tasks)
+            for parameter in task.parameters
+        ])
+
+    return clone
@@ -0,0 +1,25 @@
+import hashlib
+
+from django.http import HttpResponseNotModified
+from django.utils.http import parse_etags
+
+
+def make_etag(*parts):
+    """Build a strong ETag from the validator parts of a resource."""
+    digest = hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+    return '"%s"' % digest
+
+
+def if_none_match(request, etag):
+    """Return a 304 response if the client already has ``etag``, otherwise None.
+
+    Unlike django.utils.cache this also answers POST requests, since the
+    export view takes its credentials by POST.
+    """
+    etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    if etag not in etags and '*' not in etags:
+        return None
+
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    return response
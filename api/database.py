@@ -0,0 +1,46 @@
+import time
+
+from django.conf import settings
+from django.db import connections
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """Set the SQLITE_PRAGMAS on every new SQLite connection."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+
+
+def _record_use(execute, sql, params, many, context):
+    context['connection'].last_used = time.monotonic()
+    return execute(sql, params, many, context)
+
+
+def track_connection_use(sender, connection, **kwargs):
+    """Record when every query runs on ``connection``, for check_connections."""
+    connection.last_used = time.monotonic()
+    if _record_use not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_use)
+
+
+def check_connections(**kwargs):
+    """Close persistent connections that stopped working before a request reuses them.
+
+    Django 2.2 already closes a connection after a query on it failed, but
+    a connection dropped by the server while it sat idle fails the first
+    query of the next request. Only connections that ran no query for
+    DATABASE_HEALTH_CHECK_IDLE seconds are pinged, so a busy connection is
+    never checked. This is the CONN_HEALTH_CHECKS behaviour of later Django.
+    """
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is None or not connection.settings_dict.get('CONN_HEALTH_CHECKS'):
+            continue
+        if now - getattr(connection, 'last_used', 0) < settings.DATABASE_HEALTH_CHECK_IDLE:
+            continue
+        if connection.is_usable():
+            connection.last_used = now
+        else:
+            connection.close()
@@ -0,0 +1,56 @@
+from django.db import connections, models, router, transaction
+
+from .models import Script
+from .search import unindex_objects
+
+# Scripts purged per transaction.
+PURGE_BATCH_SIZE = 100
+
+
+def _cascade(model, path):
+    """Yield ``(model, lookup path)`` for the models cascading from ``model``, children first."""
+    for relation in model._meta.related_objects:
+        if relation.on_delete is not models.CASCADE:
+            raise ValueError('%s.%s does not cascade' % (relation.related_model.__name__, relation.field.name))
+        child_path = '%s__%s' % (relation.field.name, path)
+        yield from _cascade(relation.related_model, child_path)
+        yield relation.related_model, child_path
+
+
+def delete_trees(model, object_ids):
+    """Delete objects of ``model`` and everything cascading from them.
+
+    Unlike QuerySet.delete(), nothing is loaded into memory: every table
+    below ``model`` gets one DELETE of the ids selected through the foreign
+    keys, the deepest first, all in one transaction. Delete signals are not
+    sent. The search index rows of the objects are deleted with them.
+    """
+    object_ids = list(object_ids)
+    if not object_ids:
+        return
+
+    using = router.db_for_write(model)
+    connection = connections[using]
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        unindex_objects(model._meta.model_name, object_ids)
+        for child, path in list(_cascade(model, 'id__in')) + [(model, 'id__in')]:
+            rows = child._base_manager.using(using).filter(**{path: object_ids}).values('id')
+            sql, params = rows.query.sql_with_params()
+            table = connection.ops.quote_name(child._meta.db_table)
+            cursor.execute('DELETE FROM %s WHERE id IN (%s)' % (table, sql), params)
+
+
+def soft_delete_script(script):
+    """Hide ``script`` at once; the purgescripts command deletes its tree later."""
+    Script.all_objects.filter(id=script.id).update(deleted=True)
+
+
+def purge_deleted_scripts():
+    """Delete the trees of all soft-deleted scripts and return how many were purged."""
+    purged = 0
+    while True:
+        script_ids = list(Script.all_objects.filter(deleted=True).values_list('id', flat=True)[:PURGE_BATCH_SIZE])
+        if not script_ids:
+            return purged
+        delete_trees(Script, script_ids)
+        purged += len(script_ids)
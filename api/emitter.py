@@ -0,0 +1,75 @@
+"""Fast YAML emitter for the fixed shape of exported GitLab CI scripts.
+
+The export only ever dumps a ``stages`` list and job mappings whose values
+are strings or lists of strings. For scalars that PyYAML would write plain,
+the output can be produced with string formatting; any block containing
+another scalar is handed to PyYAML, so the result is always byte-identical
+to ``yaml.dump``.
+"""
+import re
+from collections import OrderedDict
+
+import yamlordereddictloader
+from yaml import Dumper, dump
+from yaml.nodes import ScalarNode
+from yaml.resolver import Resolver
+
+# A conservative subset of the scalars PyYAML emits in plain style: ASCII
+# only, no indicator or document marker at the start, no ': ' or ' #' and
+# no trailing space or colon.
+PLAIN_SCALAR = re.compile(r'[A-Za-z0-9_./$(][A-Za-z0-9_./$() =+@%~,;:#\'"-]*\Z')
+
+# PyYAML folds plain scalars that run past this column at a space.
+BEST_WIDTH = 80
+
+STR_TAG = 'tag:yaml.org,2002:str'
+
+_resolver = Resolver()
+
+
+def _is_plain(value, column):
+    if not PLAIN_SCALAR.match(value) or value.endswith((' ', ':')):
+        return False
+    if ': ' in value or ' #' in value or value.startswith(('---', '...')):
+        return False
+    if ' ' in value and column + len(value) > BEST_WIDTH:
+        return False
+    return _resolver.resolve(ScalarNode, value, (True, False)) == STR_TAG
+
+
+def emit_stages(stage_names):
+    """Emit ``{'stages': stage_names}`` exactly as ``yaml.dump`` does."""
+    if stage_names and all(_is_plain(name, 2) for name in stage_names):
+        return 'stages:\n' + ''.join('- %s\n' % name for name in stage_names)
+    return dump({'stages': stage_names}, Dumper=Dumper)
+
+
+def emit_task(task_name, fields):
+    """Emit one job mapping, ``fields`` being its ordered ``(key, value)`` pairs."""
+    lines = _emit_task_lines(task_name, fields)
+    if lines is not None:
+        return ''.join(lines)
+
+    dict_task = OrderedDict([(task_name, OrderedDict(fields))])
+    return dump(dict_task, Dumper=yamlordereddictloader.Dumper)
+
+
+def _emit_task_lines(task_name, fields):
+    if not fields or not _is_plain(task_name, 0):
+        return None
+
+    lines = ['%s:\n' % task_name]
+    for key, value in fields:
+        if not _is_plain(key, 2):
+            return None
+        if isinstance(value, str):
+            if not _is_plain(value, len(key) + 4):
+                return None
+            lines.append('  %s: %s\n' % (key, value))
+        else:
+            if not value or not all(_is_plain(item, 4) for item in value):
+                return None
+            lines.append('  %s:\n' % key)
+            lines.extend('  - %s\n' % item for item in value)
+
+    return lines
@@ -0,0 +1,143 @@
+import json
+from collections import OrderedDict
+from itertools import groupby
+from operator import itemgetter
+
+from django.core.cache import caches
+
+from .emitter import emit_stages, emit_task
+from .instrumentation import timed
+from .loaders import load_script_tree
+from .models import Parameter, RemovedTask, Stage, Task
+
+
+class ExportError(Exception):
+    pass
+
+
+def dump_stages(stage_names):
+    with timed('yaml'):
+        return emit_stages(stage_names) + '\n'
+
+
+def dump_task(task_name, stage_name, parameters):
+    """Dump one job block from the ``(name, parsed)`` pairs of its parameters."""
+    fields = OrderedDict([('stage', stage_name)])
+    for name, parsed in parameters:
+        value = json.loads(parsed)
+        if value is not None:
+            fields[name] = value
+    with timed('yaml'):
+        return emit_task(task_name, list(fields.items())) + '\n'
+
+
+def render_script(script):
+    stages = load_script_tree(script, deferred=('value',))
+    if not stages:
+        raise ExportError('This script doesnt have stages')
+
+    for stage in stages:
+        if not stage.tasks:
+            raise ExportError('Stage doesnt have tasks')
+
+    all_dump_tasks = []
+    for stage in stages:
+        for task in stage.tasks:
+            if task.parameters:
+                parameters = [(parameter.name, parameter.parsed) for parameter in task.parameters]
+                all_dump_tasks.append(dump_task(task.name, stage.name, parameters))
+
+    return dump_stages([stage.name for stage in stages]) + ''.join(all_dump_tasks)
+
+
+def stream_script(script):
+    """Return an iterator over the blocks of the export of ``script``.
+
+    The script is checked up front, so ExportError is raised here rather
+    than while iterating. Parameters are read with a single database
+    iterator and each job block is dumped as soon as its rows are read.
+    """
+    stage_names = list(
+        Stage.objects.filter(script=script).order_by('order', 'id').values_list('name', flat=True))
+    if not stage_names:
+        raise ExportError('This script doesnt have stages')
+
+    if Stage.objects.filter(script=script, task__isnull=True).exists():
+        raise ExportError('Stage doesnt have tasks')
+
+    return _stream_blocks(script, stage_names)
+
+
+def _stream_blocks(script, stage_names):
+    yield dump_stages(stage_names)
+
+    for _, block in _dump_tasks(Parameter.objects.filter(task__stage__script=script)):
+        yield block
+
+
+def _dump_tasks(parameters):
+    """Yield ``(task name, block)`` for the tasks of ``parameters`` in export order."""
+    rows = parameters.order_by(
+        'task__stage__order', 'task__stage_id', 'task_id', 'id',
+    ).values_list('task_id', 'task__name', 'task__stage__name', 'name', 'parsed')
+
+    for _, task_rows in groupby(rows.iterator(), key=itemgetter(0)):
+        task_rows = list(task_rows)
+        _, task_name, stage_name, _, _ = task_rows[0]
+        yield task_name, dump_task(task_name, stage_name, [(name, parsed) for _, _, _, name, parsed in task_rows])
+
+
+def render_script_delta(script, since):
+    """Return what changed in the export of ``script`` after version ``since``.
+
+    ``stages`` is the stage list block, or None if the list is unchanged,
+    ``tasks`` maps the name of every changed job to its block and
+    ``removed`` names the jobs that left the export.
+    """
+    stages = None
+    if script.stages_version > since:
+        stages = dump_stages(list(
+            Stage.objects.filter(script=script).order_by('order', 'id').values_list('name', flat=True)))
+
+    tasks = OrderedDict(_dump_tasks(
+        Parameter.objects.filter(task__stage__script=script, task__version__gt=since)))
+
+    # Tasks left without parameters are not exported any more.
+    removed = set(Task.objects.filter(
+        stage__script=script, version__gt=since, parameter__isnull=True,
+    ).values_list('name', flat=True))
+    removed.update(RemovedTask.objects.filter(script=script, version__gt=since).values_list('name', flat=True))
+    removed -= set(tasks)
+    if removed:
+        removed -= set(Task.objects.filter(
+            stage__script=script, name__in=removed, parameter__isnull=False,
+        ).values_list('name', flat=True))
+
+    return {
+        'version': script.version,
+        'stages': stages,
+        'tasks': tasks,
+        'removed': sorted(removed),
+    }
+
+
+def _cache_key(script):
+    return 'export:%d:%d' % (script.id, script.version)
+
+
+def get_cached_export(script):
+    return caches['exports'].get(_cache_key(script))
+
+
+def cached_render_script(script):
+    """Render a script, reusing the YAML cached for its current version.
+
+    Every write under a script bumps ``Script.version``, so entries of older
+    versions are never read again and age out of the cache.
+    """
+    export = get_cached_export(script)
+    if export is None:
+        export = render_script(script)
+        caches['exports'].set(_cache_key(script), export)
+
+    return export
@@ -0,0 +1,127 @@
+from django.db import IntegrityError, transaction
+from yaml import YAMLError, load
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+from .bulk import bulk_create_with_ids
+from .models import Parameter, Script, Stage, Task
+
+# Top-level keys of .gitlab-ci.yml that are not jobs.
+GLOBAL_KEYWORDS = {
+    'after_script', 'before_script', 'cache', 'default', 'image', 'include',
+    'services', 'stages', 'types', 'variables', 'workflow',
+}
+
+DEFAULT_STAGES = ['build', 'test', 'deploy']
+
+DEFAULT_JOB_STAGE = 'test'
+
+
+class ScriptImportError(Exception):
+    pass
+
+
+def _scalar(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (str, int, float)):
+        return str(value)
+    return None
+
+
+def _parameter_value(name, value):
+    """Convert a job keyword to the string the editor stores, or None if it can't be stored."""
+    if name in ('script', 'only') and isinstance(value, list):
+        values = [_scalar(item) for item in value]
+        if None in values:
+            return None
+        return ('\r\n' if name == 'script' else ' ').join(values)
+    return _scalar(value)
+
+
+def parse_script(text):
+    """Parse a .gitlab-ci.yml document.
+
+    Returns the stage names, the jobs as ``(name, stage, [(parameter, value)])``
+    and the hidden jobs and ``job.keyword`` names that could not be imported.
+    """
+    try:
+        document = load(text, Loader=SafeLoader)
+    except YAMLError:
+        raise ScriptImportError('Incorrect YAML')
+
+    if not isinstance(document, dict):
+        raise ScriptImportError('Incorrect YAML')
+
+    stage_names = document.get('stages', DEFAULT_STAGES)
+    if not isinstance(stage_names, list) or not all(isinstance(name, str) and name for name in stage_names):
+        raise ScriptImportError('Incorrect stages')
+    if len(set(stage_names)) != len(stage_names):
+        raise ScriptImportError('Duplicate stage name')
+
+    jobs = []
+    skipped = []
+    for job_name, job in document.items():
+        if job_name in GLOBAL_KEYWORDS or not isinstance(job, dict):
+            continue
+        job_name = str(job_name)
+        if job_name.startswith('.'):
+            # Hidden jobs are templates for other jobs and have no stage.
+            skipped.append(job_name)
+            continue
+
+        stage_name = job.get('stage', DEFAULT_JOB_STAGE)
+        if stage_name not in stage_names:
+            raise ScriptImportError('Job %s uses an unknown stage' % job_name)
+
+        parameters = []
+        for name, value in job.items():
+            if name == 'stage':
+                continue
+            value = _parameter_value(name, value)
+            if value is None:
+                skipped.append('%s.%s' % (job_name, name))
+            else:
+                parameters.append((str(name), value))
+        jobs.append((job_name, stage_name, parameters))
+
+    return stage_names, jobs, skipped
+
+
+def create_script_from_yaml(user, title, text):
+    """Create a script owned by ``user`` from a .gitlab-ci.yml document.
+
+    The whole tree is inserted with one bulk_create per level inside a
+    single transaction. Returns the script and the skipped keywords.
+    """
+    stage_names, jobs, skipped = parse_script(text)
+
+    try:
+        with transaction.atomic():
+            script = Script.objects.create(title=title, owner=user)
+            stages = bulk_create_with_ids(Stage, [
+                Stage(name=name, order=order, script_id=script.id)
+                for order, name in enumerate(stage_names)
+            ], ('script_id', 'name'))
+
+            stage_ids = {stage.name: stage.id for stage in stages}
+            tasks = bulk_create_with_ids(Task, [
+                Task(name=job_name, stage_id=stage_ids[stage_name])
+                for job_name, stage_name, _ in jobs
+            ], ('stage_id', 'name'))
+
+            parameters = [
+                Parameter(name=name, value=value, task_id=task.id)
+                for task, (_, _, task_parameters) in zip(tasks, jobs)
+                for name, value in task_parameters
+            ]
+            for parameter in parameters:
+                parameter.update_parsed()
+            Parameter.objects.bulk_create(parameters)
+    except IntegrityError:
+        raise ScriptImportError('This title is already in use')
+
+    return script, skipped
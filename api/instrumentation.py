@@ -0,0 +1,73 @@
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+_local = threading.local()
+
+
+@contextmanager
+def timed(name):
+    """Add the time spent in the block to the current request's ``name`` timer.
+
+    Does nothing unless InstrumentationMiddleware is handling the request.
+    """
+    timings = getattr(_local, 'timings', None)
+    if timings is None:
+        yield
+        return
+
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + perf_counter() - started
+
+
+@contextmanager
+def collect_timings():
+    timings = {}
+    _local.timings = timings
+    try:
+        yield timings
+    finally:
+        _local.timings = None
+
+
+class ViewMetrics:
+    """Counters aggregated per view since the process started."""
+
+    FIELDS = ('requests', 'wall', 'queries', 'db', 'auth', 'yaml')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, view_name, wall, queries, db, timings):
+        with self._lock:
+            counters = self._views.setdefault(view_name, dict.fromkeys(self.FIELDS, 0))
+            counters['requests'] += 1
+            counters['wall'] += wall
+            counters['queries'] += queries
+            counters['db'] += db
+            counters['auth'] += timings.get('auth', 0.0)
+            counters['yaml'] += timings.get('yaml', 0.0)
+
+    def snapshot(self):
+        with self._lock:
+            views = {name: dict(counters) for name, counters in self._views.items()}
+
+        return {
+            name: {
+                'requests': counters['requests'],
+                'wall_ms_total': round(counters['wall'] * 1000, 3),
+                'wall_ms_mean': round(counters['wall'] * 1000 / counters['requests'], 3),
+                'queries_total': counters['queries'],
+                'db_ms_total': round(counters['db'] * 1000, 3),
+                'auth_ms_total': round(counters['auth'] * 1000, 3),
+                'yaml_ms_total': round(counters['yaml'] * 1000, 3),
+            }
+            for name, counters in views.items()
+        }
+
+
+metrics = ViewMetrics()
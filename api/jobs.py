@@ -0,0 +1,115 @@
+import io
+import json
+import threading
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .exports import ExportError, cached_render_script
+from .models import ExportJob, Script
+
+# Marks the jobs queued on the worker pool of this process.
+PROCESS_ID = uuid.uuid4().hex
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.EXPORT_JOB_WORKERS, thread_name_prefix='export-job')
+        return _executor
+
+
+def shutdown_workers():
+    """Wait for the running jobs and stop the worker threads."""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def start_export_job(user, script_ids):
+    """Create an export job and hand it to the worker pool once committed."""
+    job = ExportJob.objects.create(
+        owner=user, script_ids=','.join(str(script_id) for script_id in script_ids),
+        process=PROCESS_ID, heartbeat=timezone.now())
+    transaction.on_commit(lambda: _get_executor().submit(run_export_job, job.id))
+    return job
+
+
+def get_script_ids(job):
+    return [int(script_id) for script_id in job.script_ids.split(',')]
+
+
+def _beat(job_id):
+    """Update the heartbeat of a running job and of the jobs queued behind it in this process."""
+    ExportJob.objects.filter(Q(id=job_id) | Q(status=ExportJob.PENDING, process=PROCESS_ID)).update(
+        heartbeat=timezone.now())
+
+
+def fail_stale_jobs(jobs):
+    """Mark the jobs of ``jobs`` that were lost with their process as failed.
+
+    The workers of a process update the heartbeat of their running jobs and
+    of the jobs still queued in the process after every script, so a job
+    is lost once its heartbeat is EXPORT_JOB_TIMEOUT seconds old, however
+    long it has been waiting for a worker.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.EXPORT_JOB_TIMEOUT)
+    return jobs.filter(status__in=[ExportJob.PENDING, ExportJob.RUNNING], heartbeat__lt=cutoff).update(
+        status=ExportJob.FAILED, errors=json.dumps({'job': 'Interrupted'}), finished=timezone.now())
+
+
+def run_export_job(job_id):
+    """Render every script of the job into a ZIP archive stored on the job.
+
+    Scripts that cannot be exported, or were deleted since the job was
+    created, are left out of the archive and their errors are kept on the
+    job. The job's heartbeat is updated after every script. Runs in a
+    worker thread, which gets its own database connection, closed when the
+    job is over.
+    """
+    try:
+        claimed = ExportJob.objects.filter(id=job_id, status=ExportJob.PENDING).update(status=ExportJob.RUNNING)
+        if not claimed:
+            return
+        _beat(job_id)
+
+        job = ExportJob.objects.only('script_ids').get(id=job_id)
+        script_ids = get_script_ids(job)
+        errors = {}
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for script in Script.objects.filter(id__in=script_ids).order_by('id'):
+                try:
+                    export = cached_render_script(script)
+                except ExportError as error:
+                    errors[script.id] = str(error)
+                else:
+                    zip_file.writestr('%d-%s.yml' % (script.id, slugify(script.title)), export)
+                _beat(job_id)
+                script_ids.remove(script.id)
+
+        for script_id in script_ids:
+            errors[script_id] = 'Incorrect script id'
+
+        ExportJob.objects.filter(id=job_id).update(
+            status=ExportJob.DONE, result=archive.getvalue(),
+            errors=json.dumps(errors) if errors else '', finished=timezone.now())
+    except Exception as error:
+        ExportJob.objects.filter(id=job_id).update(
+            status=ExportJob.FAILED, errors=json.dumps({'job': str(error)}), finished=timezone.now())
+    finally:
+        connection.close()
@@ -0,0 +1,22 @@
+from django.db.models import Prefetch
+
+from .models import Parameter, Stage, Task
+
+
+def load_script_tree(script, deferred=()):
+    """Load the stages of a script with their tasks and parameters in three queries.
+
+    Stages are ordered by ``Stage.order`` and every stage gets a ``tasks``
+    list whose items carry a ``parameters`` list. The Parameter fields in
+    ``deferred`` are left out of the query.
+    """
+    parameters = Parameter.objects.order_by('id')
+    if deferred:
+        parameters = parameters.defer(*deferred)
+    tasks = Task.objects.order_by('id').prefetch_related(
+        Prefetch('parameter_set', queryset=parameters, to_attr='parameters'),
+    )
+    stages = Stage.objects.filter(script=script).order_by('order', 'id').prefetch_related(
+        Prefetch('task_set', queryset=tasks, to_attr='tasks'),
+    )
+    return list(stages)
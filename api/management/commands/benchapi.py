@@ -0,0 +1,202 @@
+import json
+import re
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from api.benchmarks import benchmark_database, percentile, seed_database
+from api.exports import render_script
+from api.jobs import shutdown_workers, start_export_job
+from api.models import Parameter, Script, Stage, Task
+from api.tokens import issue_token
+from api.urls import urlpatterns
+
+PASSWORD = 'bench-password'
+
+
+class Command(BaseCommand):
+    help = ('Drive every route of the api app through the test client and report '
+            'latency percentiles, query counts and peak memory as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Timed requests per route.')
+        parser.add_argument('--scripts', type=int, default=5)
+        parser.add_argument('--stages', type=int, default=5)
+        parser.add_argument('--tasks', type=int, default=10)
+        parser.add_argument('--parameters', type=int, default=4)
+        parser.add_argument('--auth', choices=['token', 'password'], default='token')
+        parser.add_argument('--output', help='Write the report to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            self.set_up(options)
+            routes = self.routes()
+
+            report = {}
+            for pattern in urlpatterns:
+                route = str(pattern.pattern)
+                if route not in routes:
+                    raise CommandError('No benchmark request for route %s' % route)
+                report[route] = self.measure(route, routes[route], options['requests'])
+            shutdown_workers()
+
+        output = json.dumps({
+            'requests_per_route': options['requests'],
+            'auth': options['auth'],
+            'fixture': {field: options[field] for field in ('scripts', 'stages', 'tasks', 'parameters')},
+            'routes': report,
+        }, indent=2)
+
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output)
+        else:
+            self.stdout.write(output)
+
+    def set_up(self, options):
+        self.user = seed_database(
+            1, options['scripts'], options['stages'], options['tasks'], options['parameters'], PASSWORD)[0]
+        self.user.is_staff = True
+        self.user.save()
+        self.script = Script.objects.filter(owner=self.user).order_by('id').first()
+        self.stage = Stage.objects.filter(script=self.script).order_by('order', 'id').first()
+        self.task = Task.objects.filter(stage=self.stage).order_by('id').first()
+        self.export = render_script(self.script)
+        self.export_job = start_export_job(self.user, [self.script.id])
+        shutdown_workers()
+
+        # Writes go to a separate script so the read routes see a stable tree.
+        self.scratch_script = Script.objects.create(title='scratch', owner=self.user)
+        self.scratch_stage = Stage.objects.create(name='scratch', order=0, script=self.scratch_script)
+        self.reordered_stage = Stage.objects.create(name='reordered', order=1, script=self.scratch_script)
+        self.scratch_task = Task.objects.create(name='scratch', stage=self.scratch_stage)
+        self.scratch_parameter = Parameter.objects.create(name='scratch', value='', task=self.scratch_task)
+
+        if options['auth'] == 'token':
+            self.credentials = {'token': issue_token(self.user)}
+        else:
+            self.credentials = {'email': self.user.email, 'password': PASSWORD}
+        self.client = Client()
+
+    def routes(self):
+        """Map every route to a function building the ``i``-th request for it.
+
+        Each function returns ``(method, url kwargs, data, authenticated)``.
+        """
+        user = self.user
+        script, stage, task = self.script, self.stage, self.task
+        scratch_script, scratch_stage, scratch_task = self.scratch_script, self.scratch_stage, self.scratch_task
+        stage_ids = [scratch_stage.id, self.reordered_stage.id]
+
+        def batch_operations(i):
+            return json.dumps([
+                {'action': 'create', 'model': 'stage', 'temp_id': 'stage',
+                 'fields': {'name': 'batch-%d' % i, 'order': 1, 'script_id': scratch_script.id}},
+                {'action': 'create', 'model': 'task', 'temp_id': 'task',
+                 'fields': {'name': 'batch-job', 'stage_id': 'stage'}},
+                {'action': 'create', 'model': 'parameter',
+                 'fields': {'name': 'script', 'value': 'make', 'task_id': 'task'}},
+                {'action': 'remove', 'model': 'stage', 'id': 'stage'},
+            ])
+
+        return {
+            'register': lambda i: (
+                'post', {}, {'email': 'register-%d@example.com' % i, 'password': PASSWORD}, False),
+            'login': lambda i: ('post', {}, {'email': user.email, 'password': PASSWORD}, False),
+            'logout': lambda i: ('post', {}, {'token': issue_token(user)}, False),
+            'batch': lambda i: ('post', {}, {'operations': batch_operations(i)}, True),
+            'metrics': lambda i: ('get', {}, {}, True),
+            'changes': lambda i: ('get', {}, {}, True),
+            'search': lambda i: ('get', {}, {'q': 'deploy.sh'}, True),
+
+            'script': lambda i: ('get', {}, {}, True),
+            'script/create': lambda i: ('post', {}, {'title': 'created-%d' % i}, True),
+            'script/import': lambda i: ('post', {}, {'title': 'imported-%d' % i, 'yaml': self.export}, True),
+            'script/<int:script_id>/save': lambda i: (
+                'post', {'script_id': scratch_script.id}, {'title': 'scratch-%d' % i}, True),
+            'script/<int:script_id>/reorder': lambda i: (
+                'post', {'script_id': scratch_script.id}, {'stage_ids': json.dumps(stage_ids[::-1] if i % 2 else stage_ids)}, True),
+            'script/<int:script_id>/clone': lambda i: (
+                'post', {'script_id': script.id}, {'title': 'cloned-%d' % i}, True),
+            'script/<int:script_id>/export': lambda i: ('post', {'script_id': script.id}, {}, True),
+            'script/<int:script_id>/tree': lambda i: ('get', {'script_id': script.id}, {}, True),
+            'script/<int:script_id>/remove': lambda i: (
+                'post', {'script_id': Script.objects.create(title='removed-%d' % i, owner=user).id}, {}, True),
+
+            'export/create': lambda i: ('post', {}, {'script_ids': json.dumps([script.id])}, True),
+            'export/<int:job_id>': lambda i: ('get', {'job_id': self.export_job.id}, {}, True),
+            'export/<int:job_id>/download': lambda i: ('get', {'job_id': self.export_job.id}, {}, True),
+
+            'stage': lambda i: ('get', {}, {'script_id': script.id}, True),
+            'stage/create': lambda i: (
+                'post', {}, {'name': 'created-%d' % i, 'order': i, 'script_id': scratch_script.id}, True),
+            'stage/<int:stage_id>/save': lambda i: (
+                'post', {'stage_id': scratch_stage.id},
+                {'name': 'scratch-%d' % i, 'order': 0, 'script_id': scratch_script.id}, True),
+            'stage/<int:stage_id>/remove': lambda i: (
+                'post', {'stage_id': Stage.objects.create(
+                    name='removed-%d' % i, order=0, script=scratch_script).id}, {}, True),
+
+            'task': lambda i: ('get', {}, {'stage_id': stage.id}, True),
+            'task/create': lambda i: (
+                'post', {}, {'name': 'created-%d' % i, 'stage_id': scratch_stage.id}, True),
+            'task/<int:task_id>/save': lambda i: (
+                'post', {'task_id': scratch_task.id}, {'name': 'scratch-%d' % i, 'stage_id': scratch_stage.id}, True),
+            'task/<int:task_id>/remove': lambda i: (
+                'post', {'task_id': Task.objects.create(name='removed-%d' % i, stage=scratch_stage).id}, {}, True),
+
+            'parameter': lambda i: ('get', {}, {'task_id': task.id}, True),
+            'parameter/create': lambda i: (
+                'post', {}, {'name': 'created-%d' % i, 'value': 'value', 'task_id': scratch_task.id}, True),
+            'parameter/<int:parameter_id>/save': lambda i: (
+                'post', {'parameter_id': self.scratch_parameter.id},
+                {'name': 'scratch-%d' % i, 'value': 'value', 'task_id': scratch_task.id}, True),
+            'parameter/<int:parameter_id>/remove': lambda i: (
+                'post', {'parameter_id': Parameter.objects.create(
+                    name='removed-%d' % i, value='', task=scratch_task).id}, {}, True),
+        }
+
+    def send(self, route, build_request, i):
+        method, url_kwargs, data, authenticated = build_request(i)
+        path = '/api/' + re.sub(r'<int:(\w+)>', lambda match: str(url_kwargs[match.group(1)]), route)
+        if authenticated:
+            data = dict(data, **self.credentials)
+
+        response = getattr(self.client, method)(path, data)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        if response.status_code >= 400:
+            raise CommandError('%s %s answered %d: %s' % (
+                method.upper(), path, response.status_code, response.content[:200]))
+        return response
+
+    def measure(self, route, build_request, count):
+        latencies = []
+        for i in range(count):
+            started = time.perf_counter()
+            self.send(route, build_request, i)
+            latencies.append((time.perf_counter() - started) * 1000)
+        latencies.sort()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.send(route, build_request, count)
+        query_count = len(queries)
+
+        tracemalloc.start()
+        try:
+            self.send(route, build_request, count + 1)
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'queries': query_count,
+            'peak_memory_kb': round(peak_memory / 1024, 1),
+        }
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlencode
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks import benchmark_database, percentile, seed_database
+from api.models import Script, Stage, Task
+from api.tokens import issue_token
+from vcim.asgi import WSGIToASGI
+
+
+class Command(BaseCommand):
+    help = ('Compare the WSGI and ASGI entry points serving many concurrent slow clients '
+            'of the read endpoints with the same number of worker threads.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=200, help='Concurrent clients.')
+        parser.add_argument('--threads', type=int, default=16, help='Worker threads of both servers.')
+        parser.add_argument('--client-delay', type=float, default=50,
+                            help='Milliseconds each client takes to receive its response.')
+
+    def handle(self, *args, **options):
+        delay = options['client_delay'] / 1000
+
+        with benchmark_database():
+            user = seed_database(1, 1, 5, 10, 4, 'bench-password')[0]
+            token = issue_token(user)
+            script = Script.objects.get(owner=user)
+            stage = Stage.objects.filter(script=script).first()
+            task = Task.objects.filter(stage=stage).first()
+            requests = [
+                ('GET', '/api/script', {'token': token}),
+                ('GET', '/api/stage', {'token': token, 'script_id': script.id}),
+                ('GET', '/api/task', {'token': token, 'stage_id': stage.id}),
+                ('GET', '/api/parameter', {'token': token, 'task_id': task.id}),
+                ('POST', '/api/script/%d/export' % script.id, {'token': token}),
+            ]
+            requests = [requests[i % len(requests)] for i in range(options['clients'])]
+
+            server = WSGIToASGI(WSGIHandler(), max_workers=options['threads'])
+            try:
+                report = {
+                    'clients': options['clients'],
+                    'threads': options['threads'],
+                    'client_delay_ms': options['client_delay'],
+                    'wsgi': self.run_wsgi(server, requests, options['threads'], delay),
+                    'asgi': asyncio.run(self.run_asgi(server, requests, delay)),
+                }
+            finally:
+                server.executor.shutdown(wait=True)
+
+        report['speedup'] = round(report['asgi']['requests_per_second'] / report['wsgi']['requests_per_second'], 1)
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def scope(self, method, path, params):
+        query = urlencode(params) if method == 'GET' else ''
+        body = urlencode(params).encode() if method == 'POST' else b''
+        return {
+            'type': 'http',
+            'method': method,
+            'path': path,
+            'query_string': query.encode(),
+            'headers': [
+                (b'host', b'testserver'),
+                (b'content-type', b'application/x-www-form-urlencoded'),
+                (b'content-length', str(len(body)).encode()),
+            ],
+            'server': ('testserver', 80),
+            'client': ('127.0.0.1', 0),
+        }, body
+
+    def run_wsgi(self, server, requests, threads, delay):
+        """Serve every request in a thread that also feeds the slow client, like a threaded WSGI server."""
+        def serve(request):
+            scope, body = self.scope(*request)
+            statuses = []
+            response = server.wsgi_application(
+                server.environ(scope, BytesIO(body)), lambda status, headers: statuses.append(status))
+            try:
+                for _ in response:
+                    pass
+            finally:
+                response.close()
+            time.sleep(delay)
+            self.check_status(request, int(statuses[0].split(' ', 1)[0]))
+            return time.perf_counter()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            finished = list(executor.map(serve, requests))
+        return self.summary(started, finished)
+
+    async def run_asgi(self, server, requests, delay):
+        async def serve(request):
+            scope, body = self.scope(*request)
+            statuses = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.append(message['status'])
+                elif not message.get('more_body'):
+                    await asyncio.sleep(delay)
+
+            await server(scope, receive, send)
+            self.check_status(request, statuses[0])
+            return time.perf_counter()
+
+        started = time.perf_counter()
+        finished = await asyncio.gather(*(serve(request) for request in requests))
+        return self.summary(started, finished)
+
+    def check_status(self, request, status):
+        if status >= 400:
+            raise CommandError('%s %s answered %d' % (request[0], request[1], status))
+
+    def summary(self, started, finished):
+        """Summarize the completion times of requests all sent at ``started``."""
+        latencies = sorted((time_finished - started) * 1000 for time_finished in finished)
+        elapsed = max(finished) - started
+        return {
+            'seconds': round(elapsed, 3),
+            'requests_per_second': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+        }
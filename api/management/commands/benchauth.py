@@ -0,0 +1,37 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import Client
+
+from api.benchmarks import benchmark_database, requests_per_second
+
+EMAIL = 'bench@example.com'
+PASSWORD = 'bench-password'
+
+
+class Command(BaseCommand):
+    help = 'Compare requests per second of password and token authentication.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+
+    def handle(self, *args, **options):
+        count = options['requests']
+
+        with benchmark_database():
+            User.objects.create_user(EMAIL, EMAIL, PASSWORD)
+            client = Client()
+            token = client.post('/api/login', {'email': EMAIL, 'password': PASSWORD}).json()['token']
+
+            password_rps = requests_per_second(
+                lambda: client.get('/api/script', {'email': EMAIL, 'password': PASSWORD}), count)
+            token_rps = requests_per_second(
+                lambda: client.get('/api/script', {'token': token}), count)
+
+        self.stdout.write(json.dumps({
+            'requests': count,
+            'password_rps': round(password_rps, 1),
+            'token_rps': round(token_rps, 1),
+            'speedup': round(token_rps / password_rps, 1),
+        }, indent=2))
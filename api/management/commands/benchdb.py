@@ -0,0 +1,103 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection, connections
+from django.test import RequestFactory
+
+from api.benchmarks import benchmark_database, percentile, seed_database
+from api.models import Parameter
+from api.tokens import issue_token
+
+
+class Command(BaseCommand):
+    help = ('Measure write throughput of concurrent clients saving parameters under the '
+            'database profile configured by the VCIM_DB_* and VCIM_SQLITE_* variables. '
+            'Run it once per profile to compare them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8, help='Concurrent writer threads.')
+        parser.add_argument('--requests', type=int, default=200, help='Requests sent by each writer.')
+
+    def handle(self, *args, **options):
+        writers = options['writers']
+
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == 'sqlite':
+                # An in-memory test database would hide locking and journaling costs.
+                connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'benchdb.sqlite3')
+
+            with benchmark_database():
+                user = seed_database(1, 1, 1, writers, 1, 'bench-password')[0]
+                token = issue_token(user)
+                parameters = list(Parameter.objects.order_by('id'))
+                connections.close_all()
+                handler = WSGIHandler()
+
+                latencies = []
+                errors = []
+                threads = [
+                    threading.Thread(target=self.write, args=(
+                        handler, parameter, token, options['requests'], latencies, errors))
+                    for parameter in parameters
+                ]
+                started = time.perf_counter()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                elapsed = time.perf_counter() - started
+
+                journal_mode = None
+                if connection.vendor == 'sqlite':
+                    with connection.cursor() as cursor:
+                        cursor.execute('PRAGMA journal_mode')
+                        journal_mode = cursor.fetchone()[0]
+
+        latencies.sort()
+        self.stdout.write(json.dumps({
+            'profile': {
+                'vendor': connection.vendor,
+                'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+                'journal_mode': journal_mode,
+                'sqlite_pragmas': settings.SQLITE_PRAGMAS if connection.vendor == 'sqlite' else None,
+            },
+            'writers': writers,
+            'requests': len(latencies) + len(errors),
+            'errors': len(errors),
+            'requests_per_second': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 0.50), 3) if latencies else None,
+            'p99_ms': round(percentile(latencies, 0.99), 3) if latencies else None,
+        }, indent=2))
+
+    def write(self, handler, parameter, token, count, latencies, errors):
+        """Send ``count`` saves through the WSGI handler, as a server thread would.
+
+        The test client is not used as it keeps connections open regardless
+        of CONN_MAX_AGE.
+        """
+        factory = RequestFactory()
+        path = '/api/parameter/%d/save' % parameter.id
+        try:
+            for i in range(count):
+                environ = factory.post(path, {
+                    'name': parameter.name, 'value': 'value-%d' % i, 'task_id': parameter.task_id, 'token': token,
+                }).environ
+                started = time.perf_counter()
+                try:
+                    response = handler(environ, lambda status, headers: None)
+                    response.close()
+                except DatabaseError as error:
+                    errors.append(str(error))
+                    continue
+                if response.status_code >= 400:
+                    errors.append(response.status_code)
+                else:
+                    latencies.append((time.perf_counter() - started) * 1000)
+        finally:
+            connections.close_all()
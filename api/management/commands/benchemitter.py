@@ -0,0 +1,52 @@
+import json
+import time
+from collections import OrderedDict
+
+import yamlordereddictloader
+from django.core.management.base import BaseCommand, CommandError
+from yaml import dump
+
+from api.emitter import emit_task
+
+
+def sample_tasks(count):
+    for index in range(count):
+        yield 'job-%d' % index, [
+            ('stage', 'stage-%d' % (index % 10)),
+            ('script', ['npm ci', 'npm run build -- --env production', './scripts/deploy.sh %d' % index]),
+            ('only', ['master', 'develop', 'tags']),
+            ('image', 'node:12'),
+            ('when', 'manual'),
+        ]
+
+
+def blocks_per_second(emit, tasks):
+    started = time.perf_counter()
+    output = [emit(task_name, fields) for task_name, fields in tasks]
+    return len(tasks) / (time.perf_counter() - started), output
+
+
+def pyyaml_emit(task_name, fields):
+    return dump(OrderedDict([(task_name, OrderedDict(fields))]), Dumper=yamlordereddictloader.Dumper)
+
+
+class Command(BaseCommand):
+    help = 'Compare job block throughput of the export emitter and PyYAML.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        tasks = list(sample_tasks(options['tasks']))
+
+        pyyaml_rate, expected = blocks_per_second(pyyaml_emit, tasks)
+        emitter_rate, output = blocks_per_second(emit_task, tasks)
+        if output != expected:
+            raise CommandError('Emitter output differs from PyYAML')
+
+        self.stdout.write(json.dumps({
+            'tasks': len(tasks),
+            'pyyaml_blocks_per_second': round(pyyaml_rate),
+            'emitter_blocks_per_second': round(emitter_rate),
+            'speedup': round(emitter_rate / pyyaml_rate, 1),
+        }, indent=2))
@@ -0,0 +1,242 @@
+import http.client
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.db import connection, connections
+from django.test.utils import override_settings
+
+from api.benchmarks import benchmark_database, percentile, seed_database
+
+PASSWORD = 'bench-password'
+
+DEFAULT_MIX = 'login=1,scripts=3,stages=2,tasks=2,parameters=2,tree=2,save=2,export=2'
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class LoadTestServer(ThreadedWSGIServer):
+    request_queue_size = 128
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            connections.close_all()
+
+
+class Command(BaseCommand):
+    help = ('Send a weighted mix of login, listing, save and export requests from many threads '
+            'and report throughput, latency percentiles and error rates per route as JSON. '
+            'Without --url the api app is served in-process from a seeded temporary database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='Load-test a running server instead, e.g. http://127.0.0.1:8000.')
+        parser.add_argument('--email', help='User of the running server; its first script is used.')
+        parser.add_argument('--password', default=PASSWORD)
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent client threads.')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds to send requests for.')
+        parser.add_argument('--mix', default=DEFAULT_MIX,
+                            help='Comma-separated route=weight pairs out of %s.' % DEFAULT_MIX)
+        parser.add_argument('--stages', type=int, default=5, help='Stages of the seeded script.')
+        parser.add_argument('--tasks', type=int, default=10, help='Tasks per seeded stage.')
+        parser.add_argument('--parameters', type=int, default=4, help='Parameters per seeded task.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        mix = self.parse_mix(options['mix'])
+
+        if options['url']:
+            if not options['email']:
+                raise CommandError('--email is required with --url')
+            url = urlsplit(options['url'])
+            self.host, self.port = url.hostname, url.port or 80
+            report = self.run(options['email'], options['password'], mix, options)
+        else:
+            with self.serve(options) as (email, password):
+                report = self.run(email, password, mix, options)
+
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def parse_mix(self, value):
+        mix = {}
+        for item in value.split(','):
+            name, _, weight = item.partition('=')
+            name = name.strip()
+            if name not in self.routes():
+                raise CommandError('Unknown route %s in --mix' % name)
+            try:
+                mix[name] = float(weight)
+            except ValueError:
+                raise CommandError('Incorrect weight for %s in --mix' % name)
+        if not any(weight > 0 for weight in mix.values()):
+            raise CommandError('--mix needs a positive weight')
+        return mix
+
+    @contextmanager
+    def serve(self, options):
+        """Serve the api app from a threaded WSGI server on a free local port."""
+        with tempfile.TemporaryDirectory() as directory:
+            if connection.vendor == 'sqlite':
+                # Threads would share the locks of an in-memory test database.
+                connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'loadtest.sqlite3')
+
+            with benchmark_database():
+                user = seed_database(
+                    1, 1, options['stages'], options['tasks'], options['parameters'], PASSWORD, options['seed'])[0]
+                connections.close_all()
+
+                server = LoadTestServer(('127.0.0.1', 0), QuietRequestHandler)
+                server.set_app(WSGIHandler())
+                self.host, self.port = server.server_address[:2]
+                thread = threading.Thread(target=server.serve_forever, daemon=True)
+                thread.start()
+                try:
+                    with override_settings(ALLOWED_HOSTS=settings.ALLOWED_HOSTS + [self.host]):
+                        yield user.email, PASSWORD
+                finally:
+                    server.shutdown()
+                    server.server_close()
+                    thread.join()
+                    connections.close_all()
+
+    def request(self, method, path, params, token=None):
+        """Send one request on a new connection and return the status and decoded body."""
+        query = urlencode(params)
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        if token:
+            headers['Authorization'] = 'Token %s' % token
+
+        http_connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            if method == 'GET':
+                http_connection.request(method, '/api/%s?%s' % (path, query), headers=headers)
+            else:
+                http_connection.request(method, '/api/' + path, body=query, headers=headers)
+            response = http_connection.getresponse()
+            body = response.read()
+        finally:
+            http_connection.close()
+        return response.status, body
+
+    def fetch(self, method, path, params, token=None):
+        status, body = self.request(method, path, params, token)
+        if status >= 400:
+            raise CommandError('%s /api/%s answered %d: %s' % (method, path, status, body[:200]))
+        return json.loads(body.decode())
+
+    def discover(self, email, password):
+        """Log in and collect the ids of the first script of the user."""
+        token = self.fetch('POST', 'login', {'email': email, 'password': password})['token']
+        scripts = self.fetch('GET', 'script', {'limit': 1}, token)['Scripts']
+        if not scripts:
+            raise CommandError('%s has no scripts' % email)
+        tree = self.fetch('GET', 'script/%d/tree' % scripts[0]['id'], {}, token)
+
+        tasks = [task for stage in tree['Stages'] for task in stage['Tasks']]
+        parameters = [dict(parameter, task_id=task['id']) for task in tasks for parameter in task['Parameters']]
+        if not parameters:
+            raise CommandError('The first script of %s has no parameters' % email)
+        return {
+            'email': email,
+            'password': password,
+            'token': token,
+            'script_id': scripts[0]['id'],
+            'stage_ids': [stage['id'] for stage in tree['Stages']],
+            'task_ids': [task['id'] for task in tasks],
+            'parameters': parameters,
+        }
+
+    def routes(self):
+        """Map every route of the mix to a function building a request from the fixture."""
+        return {
+            'login': lambda f, rnd: ('POST', 'login', {'email': f['email'], 'password': f['password']}),
+            'scripts': lambda f, rnd: ('GET', 'script', {}),
+            'stages': lambda f, rnd: ('GET', 'stage', {'script_id': f['script_id']}),
+            'tasks': lambda f, rnd: ('GET', 'task', {'stage_id': rnd.choice(f['stage_ids'])}),
+            'parameters': lambda f, rnd: ('GET', 'parameter', {'task_id': rnd.choice(f['task_ids'])}),
+            'tree': lambda f, rnd: ('GET', 'script/%d/tree' % f['script_id'], {}),
+            'save': lambda f, rnd: self.save_request(rnd.choice(f['parameters']), rnd),
+            'export': lambda f, rnd: ('POST', 'script/%d/export' % f['script_id'], {}),
+        }
+
+    def save_request(self, parameter, rnd):
+        return ('POST', 'parameter/%d/save' % parameter['id'], {
+            'name': parameter['name'], 'value': 'value-%d' % rnd.randrange(1000), 'task_id': parameter['task_id'],
+        })
+
+    def run(self, email, password, mix, options):
+        fixture = self.discover(email, password)
+        routes = self.routes()
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        results = {name: {'latencies': [], 'errors': 0} for name in names}
+        results_lock = threading.Lock()
+
+        def work(worker):
+            rnd = random.Random('%d-%d' % (options['seed'], worker))
+            local = {name: {'latencies': [], 'errors': 0} for name in names}
+            while time.perf_counter() < deadline:
+                name = rnd.choices(names, weights)[0]
+                method, path, params = routes[name](fixture, rnd)
+                sent = time.perf_counter()
+                try:
+                    status, _ = self.request(method, path, params, None if name == 'login' else fixture['token'])
+                except (OSError, http.client.HTTPException):
+                    status = None
+                if status is None or status >= 400:
+                    local[name]['errors'] += 1
+                else:
+                    local[name]['latencies'].append((time.perf_counter() - sent) * 1000)
+            with results_lock:
+                for name in names:
+                    results[name]['latencies'].extend(local[name]['latencies'])
+                    results[name]['errors'] += local[name]['errors']
+
+        threads = [threading.Thread(target=work, args=(worker,)) for worker in range(options['threads'])]
+        started = time.perf_counter()
+        deadline = started + options['duration']
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        report = {
+            'target': options['url'] or 'in-process',
+            'threads': options['threads'],
+            'seconds': round(elapsed, 3),
+            'mix': mix,
+            'requests': 0,
+            'errors': 0,
+            'routes': {},
+        }
+        for name in names:
+            latencies = sorted(results[name]['latencies'])
+            errors = results[name]['errors']
+            requests = len(latencies) + errors
+            report['requests'] += requests
+            report['errors'] += errors
+            report['routes'][name] = {
+                'requests': requests,
+                'requests_per_second': round(requests / elapsed, 1),
+                'error_rate': round(errors / requests, 4) if requests else None,
+                'p50_ms': round(percentile(latencies, 0.50), 3) if latencies else None,
+                'p95_ms': round(percentile(latencies, 0.95), 3) if latencies else None,
+                'p99_ms': round(percentile(latencies, 0.99), 3) if latencies else None,
+            }
+        report['requests_per_second'] = round(report['requests'] / elapsed, 1)
+        report['error_rate'] = round(report['errors'] / report['requests'], 4) if report['requests'] else None
+        return report
@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.changes import prune_changes
+from api.deletion import purge_deleted_scripts
+from api.tracking import prune_removed_tasks
+
+
+class Command(BaseCommand):
+    help = ('Delete soft-deleted scripts with their stages, tasks and parameters, '
+            'the removed job tombstones older than REMOVED_TASK_RETENTION_DAYS '
+            'and the change log entries older than CHANGELOG_RETENTION_DAYS.')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Purged %d scripts.' % purge_deleted_scripts())
+        before = timezone.now() - timedelta(days=settings.REMOVED_TASK_RETENTION_DAYS)
+        self.stdout.write('Pruned %d removed job tombstones.' % prune_removed_tasks(before))
+        before = timezone.now() - timedelta(days=settings.CHANGELOG_RETENTION_DAYS)
+        self.stdout.write('Pruned %d change log entries.' % prune_changes(before))
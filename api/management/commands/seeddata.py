@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from api.benchmarks import seed_database
+from api.models import Parameter, Script, Stage, Task
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with synthetic users, scripts, stages, tasks and parameters.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--scripts', type=int, default=10, help='Scripts per user.')
+        parser.add_argument('--stages', type=int, default=5, help='Stages per script.')
+        parser.add_argument('--tasks', type=int, default=5, help='Tasks per stage.')
+        parser.add_argument('--parameters', type=int, default=4, help='Parameters per task.')
+        parser.add_argument('--password', default='bench-password')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        users = seed_database(
+            options['users'], options['scripts'], options['stages'], options['tasks'],
+            options['parameters'], options['password'], options['seed'],
+        )
+
+        self.stdout.write('Created %d users; the database now holds %d scripts, %d stages, '
+                          '%d tasks and %d parameters.' % (
+                              len(users), Script.objects.count(), Stage.objects.count(),
+                              Task.objects.count(), Parameter.objects.count()))
+        if users:
+            self.stdout.write('First user: %s' % users[0].email)
@@ -0,0 +1,51 @@
+from contextlib import ExitStack
+from time import perf_counter
+
+from django.db import connections
+
+from .instrumentation import collect_timings, metrics
+
+
+class InstrumentationMiddleware:
+    """Record wall time, database queries and auth/YAML time of every view.
+
+    The numbers are sent in a Server-Timing header and aggregated per view
+    for the metrics endpoint. Time spent producing a streamed body after
+    the view returns is not included.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = [0, 0.0]
+
+        def count_query(execute, sql, params, many, context):
+            started = perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries[0] += 1
+                queries[1] += perf_counter() - started
+
+        started = perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(count_query))
+            timings = stack.enter_context(collect_timings())
+            response = self.get_response(request)
+        wall = perf_counter() - started
+
+        query_count, db_time = queries
+        response['Server-Timing'] = ', '.join([
+            'total;dur=%.3f' % (wall * 1000),
+            'db;dur=%.3f;desc="%d queries"' % (db_time * 1000, query_count),
+            'auth;dur=%.3f' % (timings.get('auth', 0.0) * 1000),
+            'yaml;dur=%.3f' % (timings.get('yaml', 0.0) * 1000),
+        ])
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        view_name = resolver_match.view_name if resolver_match else 'unresolved'
+        metrics.record(view_name, wall, query_count, db_time, timings)
+
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_revokedtoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='script',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
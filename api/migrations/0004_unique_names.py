@@ -0,0 +1,62 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:31
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicates(apps, schema_editor):
+    """Make existing rows satisfy the new unique constraints.
+
+    Duplicate parameters are deleted except for the newest, which is the
+    one exports already emitted. Duplicate scripts, stages and tasks keep
+    their content and get their id appended to the name.
+    """
+    Parameter = apps.get_model('api', 'Parameter')
+    duplicates = Parameter.objects.values('task', 'name').annotate(count=Count('id'), last_id=Max('id'))
+    for duplicate in duplicates.filter(count__gt=1):
+        Parameter.objects.filter(
+            task=duplicate['task'], name=duplicate['name'], id__lt=duplicate['last_id']).delete()
+
+    for model_name, parent_field, name_field in (
+            ('Script', 'owner', 'title'), ('Stage', 'script', 'name'), ('Task', 'stage', 'name')):
+        model = apps.get_model('api', model_name)
+        max_length = model._meta.get_field(name_field).max_length
+        duplicates = model.objects.values(parent_field, name_field).annotate(count=Count('id'))
+        for duplicate in duplicates.filter(count__gt=1):
+            renamed = model.objects.filter(
+                **{parent_field: duplicate[parent_field], name_field: duplicate[name_field]}).order_by('id')[1:]
+            for obj in renamed:
+                suffix = ' (%d)' % obj.id
+                setattr(obj, name_field, getattr(obj, name_field)[:max_length - len(suffix)] + suffix)
+                obj.save(update_fields=[name_field])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_script_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='stage',
+            index=models.Index(fields=['script', 'order'], name='api_stage_script_order_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='parameter',
+            constraint=models.UniqueConstraint(fields=('task', 'name'), name='unique_parameter_name'),
+        ),
+        migrations.AddConstraint(
+            model_name='script',
+            constraint=models.UniqueConstraint(fields=('owner', 'title'), name='unique_script_title'),
+        ),
+        migrations.AddConstraint(
+            model_name='stage',
+            constraint=models.UniqueConstraint(fields=('script', 'name'), name='unique_stage_name'),
+        ),
+        migrations.AddConstraint(
+            model_name='task',
+            constraint=models.UniqueConstraint(fields=('stage', 'name'), name='unique_task_name'),
+        ),
+    ]
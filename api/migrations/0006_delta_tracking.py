@@ -0,0 +1,48 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:01
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+import django.db.models.deletion
+
+
+def stamp_current_versions(apps, schema_editor):
+    # Existing tasks and stage lists count as changed at the current version.
+    Script = apps.get_model('api', 'Script')
+    Task = apps.get_model('api', 'Task')
+    Script.objects.update(stages_version=F('version'))
+    Task.objects.update(version=Subquery(
+        Script.objects.filter(stage=OuterRef('stage_id')).values('version')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_exportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='script',
+            name='stages_version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.CreateModel(
+            name='RemovedTask',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('version', models.PositiveIntegerField()),
+                ('script', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.Script')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='removedtask',
+            index=models.Index(fields=['script', 'version'], name='api_removedtask_version_idx'),
+        ),
+        migrations.RunPython(stamp_current_versions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:05
+
+import json
+import re
+
+from django.db import migrations, models
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+# A copy of api.parameters.parse_value as of this migration, so that later
+# changes to the export don't change what this migration writes.
+def parse_value(name, value):
+    if not value:
+        return None
+    if name == 'script':
+        return [item for item in value.split('\r\n') if item]
+    if name == 'only':
+        return [item for item in re.split('[ ;,]', value) if item]
+    return value
+
+
+def backfill_parsed(apps, schema_editor):
+    Parameter = apps.get_model('api', 'Parameter')
+    batch = []
+    for parameter in Parameter.objects.only('id', 'name', 'value').iterator():
+        parameter.parsed = json.dumps(parse_value(parameter.name, parameter.value))
+        batch.append(parameter)
+        if len(batch) == BACKFILL_BATCH_SIZE:
+            Parameter.objects.bulk_update(batch, ['parsed'])
+            batch = []
+    if batch:
+        Parameter.objects.bulk_update(batch, ['parsed'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_delta_tracking'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='parameter',
+            name='parsed',
+            field=models.TextField(default='null'),
+        ),
+        migrations.RunPython(backfill_parsed, migrations.RunPython.noop),
+    ]
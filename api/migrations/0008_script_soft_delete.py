@@ -0,0 +1,26 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_parameter_parsed'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='script',
+            name='unique_script_title',
+        ),
+        migrations.AddField(
+            model_name='script',
+            name='deleted',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddConstraint(
+            model_name='script',
+            constraint=models.UniqueConstraint(condition=models.Q(deleted=False), fields=('owner', 'title'), name='unique_script_title'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+from django.db import migrations
+
+# SQLite: an FTS5 trigram table written by the application whenever it logs
+# a change (api.search). A row's rowid is the object id plus 2 ** 32 times
+# its model code (0 script, 1 stage, 2 task, 3 parameter), and the owner id
+# is an indexed column, delimited as u<id>u, so that a search intersects the
+# owner's rows inside the index. The trigram tokenizer needs SQLite 3.34;
+# with an older SQLite no table is created and searches scan the tables.
+SQLITE_TRIGRAM_VERSION = (3, 34, 0)
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE api_search USING fts5(body, owner, script_id UNINDEXED, tokenize = 'trigram')",
+
+    'INSERT INTO api_search (rowid, body, owner, script_id) '
+    "SELECT id, title, 'u' || owner_id || 'u', id FROM api_script",
+    'INSERT INTO api_search (rowid, body, owner, script_id) '
+    "SELECT api_stage.id + 4294967296, api_stage.name, 'u' || api_script.owner_id || 'u', api_script.id "
+    'FROM api_stage JOIN api_script ON api_script.id = api_stage.script_id',
+    'INSERT INTO api_search (rowid, body, owner, script_id) '
+    "SELECT api_task.id + 8589934592, api_task.name, 'u' || api_script.owner_id || 'u', api_script.id "
+    'FROM api_task JOIN api_stage ON api_stage.id = api_task.stage_id '
+    'JOIN api_script ON api_script.id = api_stage.script_id',
+    'INSERT INTO api_search (rowid, body, owner, script_id) '
+    "SELECT api_parameter.id + 12884901888, api_parameter.value, 'u' || api_script.owner_id || 'u', api_script.id "
+    'FROM api_parameter JOIN api_task ON api_task.id = api_parameter.task_id '
+    'JOIN api_stage ON api_stage.id = api_task.stage_id JOIN api_script ON api_script.id = api_stage.script_id',
+]
+
+SQLITE_BACKWARD = [
+    'DROP TABLE IF EXISTS api_search',
+]
+
+# PostgreSQL: trigram indexes serve the substring matches of every column
+# and stay in sync with the tables by themselves.
+POSTGRESQL_FORWARD = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX api_script_title_trgm ON api_script USING gin (title gin_trgm_ops)',
+    'CREATE INDEX api_stage_name_trgm ON api_stage USING gin (name gin_trgm_ops)',
+    'CREATE INDEX api_task_name_trgm ON api_task USING gin (name gin_trgm_ops)',
+    'CREATE INDEX api_parameter_value_trgm ON api_parameter USING gin (value gin_trgm_ops)',
+]
+
+POSTGRESQL_BACKWARD = [
+    'DROP INDEX api_script_title_trgm',
+    'DROP INDEX api_stage_name_trgm',
+    'DROP INDEX api_task_name_trgm',
+    'DROP INDEX api_parameter_value_trgm',
+]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        connection = schema_editor.connection
+        if connection.vendor == 'sqlite' and connection.Database.sqlite_version_info < SQLITE_TRIGRAM_VERSION:
+            return
+        for statement in statements.get(connection.vendor, []):
+            schema_editor.execute(statement, params=None)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_changelog'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRESQL_FORWARD}),
+            run_for_vendor({'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRESQL_BACKWARD}),
+        ),
+    ]
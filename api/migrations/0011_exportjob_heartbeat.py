@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportjob',
+            name='heartbeat',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
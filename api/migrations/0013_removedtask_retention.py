@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_exportjob_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='removedtask',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='script',
+            name='removed_tasks_pruned',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
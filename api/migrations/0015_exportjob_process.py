@@ -0,0 +1,26 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:37
+
+from django.db import migrations, models
+
+
+# Jobs are now judged lost by heartbeat alone; pending jobs queued before
+# this migration never had one.
+def backfill_heartbeat(apps, schema_editor):
+    ExportJob = apps.get_model('api', 'ExportJob')
+    ExportJob.objects.filter(heartbeat__isnull=True).update(heartbeat=models.F('created'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_changelog_created'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportjob',
+            name='process',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.RunPython(backfill_heartbeat, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,34 @@
+import json
+
 from django.contrib.auth.models import User
 from django.db import models
 
+from .parameters import parse_value
+
+
+class ScriptManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted=False)
+
 
 class Script(models.Model):
     title = models.CharField(max_length=255)
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    version = models.PositiveIntegerField(default=1)
+    stages_version = models.PositiveIntegerField(default=1)
+    # Soft-deleted scripts are hidden from ``objects`` until they are purged.
+    deleted = models.BooleanField(default=False)
+    # Highest version of the pruned RemovedTask tombstones of the script.
+    removed_tasks_pruned = models.PositiveIntegerField(default=0)
+
+    objects = ScriptManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['owner', 'title'], condition=models.Q(deleted=False), name='unique_script_title'),
+        ]
 
 
 class Stage(models.Model):
@@ -12,13 +36,108 @@ class Stage(models.Model):
     order = models.IntegerField()
     script = models.ForeignKey(Script, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['script', 'name'], name='unique_stage_name'),
+        ]
+        indexes = [
+            models.Index(fields=['script', 'order'], name='api_stage_script_order_idx'),
+        ]
+
 
 class Task(models.Model):
     name = models.CharField(max_length=255)
     stage = models.ForeignKey(Stage, on_delete=models.CASCADE)
+    version = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['stage', 'name'], name='unique_task_name'),
+        ]
 
 
 class Parameter(models.Model):
     name = models.CharField(max_length=255)
     value = models.TextField()
+    # JSON of parse_value(name, value), kept in step with name and value.
+    parsed = models.TextField(default='null')
     task = models.ForeignKey(Task, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['task', 'name'], name='unique_parameter_name'),
+        ]
+
+    def update_parsed(self):
+        """Refresh ``parsed``; bulk_create and bulk_update callers must call this themselves."""
+        self.parsed = json.dumps(parse_value(self.name, self.value))
+
+    def save(self, *args, **kwargs):
+        self.update_parsed()
+        super().save(*args, **kwargs)
+
+
+class RemovedTask(models.Model):
+    script = models.ForeignKey(Script, on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    version = models.PositiveIntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['script', 'version'], name='api_removedtask_version_idx'),
+        ]
+
+
+class ChangeLog(models.Model):
+    CREATE = 'create'
+    SAVE = 'save'
+    REMOVE = 'remove'
+    ACTIONS = [
+        (CREATE, 'Create'),
+        (SAVE, 'Save'),
+        (REMOVE, 'Remove'),
+    ]
+
+    # The owner of the changed script; the id is the cursor of the change feed.
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Not a foreign key, so the entries of removed scripts are kept.
+    script_id = models.PositiveIntegerField()
+    model = models.CharField(max_length=16)
+    object_id = models.PositiveIntegerField()
+    action = models.CharField(max_length=16, choices=ACTIONS)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'id'], name='api_changelog_owner_id_idx'),
+        ]
+
+
+class RevokedToken(models.Model):
+    token_id = models.CharField(max_length=32, unique=True)
+    expires = models.DateTimeField()
+
+
+class ExportJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    script_ids = models.TextField()
+    status = models.CharField(max_length=16, choices=STATUSES, default=PENDING)
+    errors = models.TextField(blank=True)
+    result = models.BinaryField(null=True)
+    created = models.DateTimeField(auto_now_add=True)
+    # The process whose worker pool the job was handed to.
+    process = models.CharField(max_length=32, blank=True)
+    heartbeat = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True)
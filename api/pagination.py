@@ -0,0 +1,46 @@
+from django.conf import settings
+
+
+def get_page_params(params):
+    """Read the ``cursor`` and ``limit`` listing parameters.
+
+    Raises ValueError with the error message for the response.
+    """
+    cursor = params.get('cursor')
+    limit = params.get('limit')
+
+    try:
+        cursor = int(cursor) if cursor else 0
+    except ValueError:
+        raise ValueError('Incorrect data type cursor')
+
+    if not limit:
+        return cursor, None
+
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValueError('Incorrect data type limit')
+    if limit <= 0:
+        raise ValueError('Limit must be positive')
+
+    return cursor, min(limit, settings.API_MAX_PAGE_SIZE)
+
+
+def keyset_page(queryset, fields, cursor, limit):
+    """Return the rows of ``queryset`` with an id above ``cursor`` and the next cursor.
+
+    Rows are ``fields`` dicts ordered by id. Without a ``limit`` a page
+    holds at most API_MAX_PAGE_SIZE rows, and the next cursor is None once
+    the last row has been returned.
+    """
+    if limit is None:
+        limit = settings.API_MAX_PAGE_SIZE
+
+    rows = queryset.filter(id__gt=cursor).order_by('id').values(*fields)
+    rows = list(rows[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    return rows, rows[-1]['id']
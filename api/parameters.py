@@ -0,0 +1,17 @@
+import re
+
+
+def parse_value(name, value):
+    """Return a parameter the way the export writes it.
+
+    ``script`` values are split into lines and ``only`` values on spaces,
+    semicolons and commas, dropping empty items. An empty value gives
+    None, as the export leaves it out.
+    """
+    if not value:
+        return None
+    if name == 'script':
+        return [item for item in value.split('\r\n') if item]
+    if name == 'only':
+        return [item for item in re.split('[ ;,]', value) if item]
+    return value
@@ -0,0 +1,70 @@
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+
+_state = threading.local()
+
+
+class ReplicaRouter:
+    """Send reads to the replica picked for the current read-only view, everything else to default.
+
+    Outside ``call_routed`` (writes, authentication, background jobs and
+    management commands) every query goes to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        return getattr(_state, 'replica', None) or 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+def _sticky_key(user):
+    return 'primary:%d' % user.id
+
+
+@contextmanager
+def _reading_from(replica):
+    previous = getattr(_state, 'replica', None)
+    _state.replica = replica
+    try:
+        yield
+    finally:
+        _state.replica = previous
+
+
+def _stream_from(replica, content):
+    with _reading_from(replica):
+        yield from content
+
+
+def call_routed(user, read_only, view, *args, **kwargs):
+    """Call ``view`` for ``user`` with its reads on one replica if it is ``read_only``.
+
+    A user who called a writing view in the last DATABASE_STICKY_SECONDS,
+    in any process sharing the DATABASE_STICKY_CACHE cache, reads from the
+    primary, so they see their own writes despite replication lag.
+    Streaming responses keep the replica while they are iterated.
+    """
+    if not settings.DATABASE_REPLICAS:
+        return view(*args, **kwargs)
+
+    sticky = caches[settings.DATABASE_STICKY_CACHE]
+    replica = None
+    if read_only and not sticky.get(_sticky_key(user)):
+        replica = random.choice(settings.DATABASE_REPLICAS)
+
+    with _reading_from(replica):
+        response = view(*args, **kwargs)
+
+    if not read_only:
+        sticky.set(_sticky_key(user), True, settings.DATABASE_STICKY_SECONDS)
+    elif replica and response.streaming:
+        response.streaming_content = _stream_from(replica, response.streaming_content)
+    return response
@@ -0,0 +1,222 @@
+from django.db import connections, router
+
+from .models import Script
+
+MODELS = ('script', 'stage', 'task', 'parameter')
+
+# A result's key is its object id plus KEY_STRIDE times the position of its
+# model in MODELS. On SQLite the key is the rowid of the search index.
+KEY_STRIDE = 2 ** 32
+
+# Results per page when the client passes no limit.
+SEARCH_PAGE_SIZE = 20
+
+# Both indexes are trigram indexes: a term shorter than this can only filter
+# the matches of the longer terms of the query.
+MIN_TERM_LENGTH = 3
+
+# The trigram tokenizer can't match an owner id of fewer than three digits,
+# and a delimited id is a substring of no other owner's.
+SQLITE_OWNER = "'u' || api_script.owner_id || 'u'"
+
+# model name -> (indexed column, tables joined up to api_script)
+SQLITE_ROWS = {
+    'script': ('api_script.title', 'api_script'),
+    'stage': ('api_stage.name', 'api_stage JOIN api_script ON api_script.id = api_stage.script_id'),
+    'task': ('api_task.name', 'api_task JOIN api_stage ON api_stage.id = api_task.stage_id '
+                              'JOIN api_script ON api_script.id = api_stage.script_id'),
+    'parameter': ('api_parameter.value', 'api_parameter JOIN api_task ON api_task.id = api_parameter.task_id '
+                                         'JOIN api_stage ON api_stage.id = api_task.stage_id '
+                                         'JOIN api_script ON api_script.id = api_stage.script_id'),
+}
+
+# Objects (re)indexed per statement.
+SQLITE_INDEX_BATCH_SIZE = 500
+
+# database alias -> whether it has the api_search index
+_sqlite_indexes = {}
+
+# Matches are ranked by the bm25 score of FTS5, then by key.
+SQLITE_SEARCH = (
+    'SELECT rowid, script_id, body FROM api_search WHERE api_search MATCH %s{like} '
+    'ORDER BY rank, rowid LIMIT %s OFFSET %s'
+)
+
+# Without the index of api_search, and on PostgreSQL, the tables are
+# searched directly. PostgreSQL ranks matches by trigram similarity to the
+# query; a SQLite without an index ranks the shortest texts first.
+TABLE_SEARCH = (
+    'SELECT key, script_id, body FROM ('
+    'SELECT api_script.id AS key, api_script.id AS script_id, api_script.title AS body '
+    'FROM api_script WHERE {script} AND {title} '
+    'UNION ALL '
+    'SELECT api_stage.id + {stage_offset}, api_script.id, api_stage.name '
+    'FROM api_stage JOIN api_script ON api_script.id = api_stage.script_id WHERE {script} AND {stage} '
+    'UNION ALL '
+    'SELECT api_task.id + {task_offset}, api_script.id, api_task.name '
+    'FROM api_task JOIN api_stage ON api_stage.id = api_task.stage_id '
+    'JOIN api_script ON api_script.id = api_stage.script_id WHERE {script} AND {task} '
+    'UNION ALL '
+    'SELECT api_parameter.id + {parameter_offset}, api_script.id, api_parameter.value '
+    'FROM api_parameter JOIN api_task ON api_task.id = api_parameter.task_id '
+    'JOIN api_stage ON api_stage.id = api_task.stage_id '
+    'JOIN api_script ON api_script.id = api_stage.script_id WHERE {script} AND {parameter}'
+    ') results ORDER BY {order}, key LIMIT %s OFFSET %s'
+)
+
+POSTGRESQL_ORDER = 'similarity(body, %s) DESC'
+
+SQLITE_ORDER = 'length(body)'
+
+
+def _fts_string(term):
+    return '"%s"' % term.replace('"', '""')
+
+
+def _like_pattern(term):
+    return '%%%s%%' % term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _sqlite_rows(model_name, root_name, count):
+    """SQL selecting the search rows of the ``model_name`` objects under ``count`` ``root_name`` ids."""
+    position = MODELS.index(model_name)
+    column, tables = SQLITE_ROWS[model_name]
+    return 'SELECT api_%s.id + %d AS key, %s, %s, api_script.id FROM %s WHERE api_%s.id IN (%s)' % (
+        model_name, position * KEY_STRIDE, column, SQLITE_OWNER, tables, root_name, ', '.join(['%s'] * count))
+
+
+def _has_sqlite_index(connection):
+    """Tell whether the database of ``connection`` has the api_search index, see migration 0010."""
+    if connection.alias not in _sqlite_indexes:
+        _sqlite_indexes[connection.alias] = 'api_search' in connection.introspection.table_names()
+    return _sqlite_indexes[connection.alias]
+
+
+def _update_sqlite_index(model_name, object_ids, descendants, insert):
+    connection = connections[router.db_for_write(Script)]
+    if connection.vendor != 'sqlite' or model_name not in MODELS or not _has_sqlite_index(connection):
+        return
+
+    object_ids = list(object_ids)
+    model_names = MODELS[MODELS.index(model_name):] if descendants else [model_name]
+    with connection.cursor() as cursor:
+        for start in range(0, len(object_ids), SQLITE_INDEX_BATCH_SIZE):
+            batch = object_ids[start:start + SQLITE_INDEX_BATCH_SIZE]
+            for name in model_names:
+                rows = _sqlite_rows(name, model_name, len(batch))
+                cursor.execute('DELETE FROM api_search WHERE rowid IN (SELECT key FROM (%s))' % rows, batch)
+                if insert:
+                    cursor.execute('INSERT INTO api_search (rowid, body, owner, script_id) %s' % rows, batch)
+
+
+def index_objects(model_name, object_ids, descendants=True):
+    """Write the search rows of the given objects again, and those of everything under them.
+
+    Only SQLite keeps a separate index; the PostgreSQL indexes are on the
+    tables themselves.
+    """
+    _update_sqlite_index(model_name, object_ids, descendants, insert=True)
+
+
+def unindex_objects(model_name, object_ids):
+    """Delete the search rows of the given objects and of everything under them.
+
+    Call it before the objects are deleted.
+    """
+    _update_sqlite_index(model_name, object_ids, descendants=True, insert=False)
+
+
+def update_search_index(changes):
+    """Index what the ``(script id, model name, object id, action)`` changes created or saved.
+
+    A saved stage or task may have moved to another owner's script, so it
+    is indexed with everything under it. Removed objects are left to
+    unindex_objects.
+    """
+    saved = {}
+    for _, model_name, object_id, action in changes:
+        if action != 'remove':
+            descendants = not (model_name == 'script' and action == 'save')
+            saved.setdefault((model_name, descendants), set()).add(object_id)
+    for (model_name, descendants), object_ids in saved.items():
+        index_objects(model_name, object_ids, descendants)
+
+
+def _search_sqlite(cursor, user, terms, offset, limit):
+    indexed = [term for term in terms if len(term) >= MIN_TERM_LENGTH]
+    short = [term for term in terms if len(term) < MIN_TERM_LENGTH]
+    match = 'owner : %s AND body : (%s)' % (
+        _fts_string('u%du' % user.id), ' AND '.join(_fts_string(term) for term in indexed))
+    like = " AND body LIKE %s ESCAPE '\\'" * len(short)
+    params = [match] + [_like_pattern(term) for term in short] + [limit, offset]
+    cursor.execute(SQLITE_SEARCH.format(like=like), params)
+    return cursor.fetchall()
+
+
+def _search_tables(cursor, user, terms, offset, limit, like, order, order_params):
+    columns = {
+        'title': 'api_script.title', 'stage': 'api_stage.name',
+        'task': 'api_task.name', 'parameter': 'api_parameter.value',
+    }
+    conditions = {
+        name: ' AND '.join(['%s %s' % (column, like)] * len(terms))
+        for name, column in columns.items()
+    }
+    conditions['script'] = 'api_script.owner_id = %s'
+    conditions['order'] = order
+    for position, model_name in enumerate(MODELS[1:], 1):
+        conditions['%s_offset' % model_name] = position * KEY_STRIDE
+    patterns = [_like_pattern(term) for term in terms]
+    params = []
+    for _ in columns:
+        params += [user.id] + patterns
+    cursor.execute(TABLE_SEARCH.format(**conditions), params + order_params + [limit, offset])
+    return cursor.fetchall()
+
+
+def _search_postgresql(cursor, user, terms, offset, limit):
+    return _search_tables(cursor, user, terms, offset, limit, 'ILIKE %s', POSTGRESQL_ORDER, [' '.join(terms)])
+
+
+def _search_sqlite_tables(cursor, user, terms, offset, limit):
+    return _search_tables(cursor, user, terms, offset, limit, "LIKE %s ESCAPE '\\'", SQLITE_ORDER, [])
+
+
+def search_scripts(user, query, cursor, limit):
+    """Search the script titles, stage and task names and parameter values of ``user``.
+
+    Every whitespace-separated term of ``query`` must be a substring of the
+    text, ignoring case, and at least one term must have MIN_TERM_LENGTH
+    characters. Results are ranked by relevance, see SQLITE_SEARCH and
+    TABLE_SEARCH, and paginated by offset: ``cursor`` is the number of
+    results on the previous pages and the returned next cursor is None on
+    the last page. Results in soft-deleted scripts are dropped from the
+    page, so a page can come back short until those scripts are purged.
+
+    Raises ValueError with the error message for the response.
+    """
+    terms = query.split()
+    if not any(len(term) >= MIN_TERM_LENGTH for term in terms):
+        raise ValueError('Search terms need at least %d characters' % MIN_TERM_LENGTH)
+
+    limit = limit or SEARCH_PAGE_SIZE
+    connection = connections[router.db_for_read(Script)]
+    if connection.vendor != 'sqlite':
+        search = _search_postgresql
+    elif _has_sqlite_index(connection):
+        search = _search_sqlite
+    else:
+        search = _search_sqlite_tables
+    cursor = max(cursor, 0)
+    with connection.cursor() as db_cursor:
+        rows = search(db_cursor, user, terms, cursor, limit + 1)
+
+    next_cursor = cursor + limit if len(rows) > limit else None
+    rows = rows[:limit]
+    deleted = set(Script.all_objects.using(connection.alias).filter(
+        id__in={script_id for _, script_id, _ in rows}, deleted=True).values_list('id', flat=True))
+    return [
+        {'model': MODELS[key // KEY_STRIDE], 'id': key % KEY_STRIDE, 'script_id': script_id, 'text': body}
+        for key, script_id, body in rows
+        if script_id not in deleted
+    ], next_cursor
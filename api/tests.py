@@ -0,0 +1,960 @@
+import asyncio
+import io
+import json
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from importlib import import_module
+from unittest import mock, skipUnless
+
+import yaml
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import CacheHandler, caches
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.management import call_command
+from django.db import connection, connections, router
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from vcim.asgi import WSGIToASGI
+
+from .batch import BatchError, apply_operations
+from .database import check_connections
+from .emitter import emit_stages, emit_task
+from .deletion import delete_trees, purge_deleted_scripts
+from .exports import render_script
+from .jobs import PROCESS_ID, run_export_job
+from .loaders import load_script_tree
+from .models import ChangeLog, ExportJob, Parameter, RemovedTask, Script, Stage, Task
+from .routers import call_routed
+from .search import KEY_STRIDE, _search_postgresql
+from .tokens import issue_token
+from .tracking import touch_scripts
+
+PASSWORD = 'test-password'
+
+
+def make_script(owner, title='pipeline', stages=3, tasks=4):
+    script = Script.objects.create(title=title, owner=owner)
+    for stage_index in range(stages):
+        stage = Stage.objects.create(name='stage-%d' % stage_index, order=stage_index, script=script)
+        for task_index in range(tasks):
+            task = Task.objects.create(name='job-%d-%d' % (stage_index, task_index), stage=stage)
+            Parameter.objects.create(name='script', value='make %d\r\nmake check' % task_index, task=task)
+            Parameter.objects.create(name='only', value='master tags', task=task)
+    return script
+
+
+class TokenTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user@example.com', 'user@example.com', PASSWORD)
+        self.token = issue_token(self.user)
+
+    def get_scripts(self):
+        return self.client.get('/api/script', {'token': self.token})
+
+    def test_deactivated_user_is_rejected_while_cached(self):
+        self.assertEqual(self.get_scripts().status_code, 200)
+        User.objects.filter(id=self.user.id).update(is_active=False)
+        self.assertEqual(self.get_scripts().status_code, 401)
+
+    def test_password_change_invalidates_token(self):
+        self.assertEqual(self.get_scripts().status_code, 200)
+        self.user.set_password('new-password')
+        self.user.save()
+        self.assertEqual(self.get_scripts().status_code, 401)
+        self.assertEqual(self.client.get('/api/script', {'token': issue_token(self.user)}).status_code, 200)
+
+
+class LoaderTests(TestCase):
+    def test_tree_is_loaded_in_three_queries(self):
+        owner = User.objects.create_user('user@example.com', 'user@example.com', PASSWORD)
+        script = make_script(owner, stages=3, tasks=4)
+
+        with self.assertNumQueries(3):
+            stages = load_script_tree(script)
+            names = [
+                (stage.name, task.name, parameter.value)
+                for stage in stages for task in stage.tasks for parameter in task.parameters
+            ]
+
+        self.assertEqual(len(stages), 3)
+        self.assertEqual(len(names), 3 * 4 * 2)
+
+    def test_export_queries_do_not_grow_with_the_tree(self):
+        caches['exports'].clear()
+        owner = User.objects.create_user('user@example.com', 'user@example.com', PASSWORD)
+        token = issue_token(owner)
+        self.client.get('/api/script', {'token': token})
+
+        query_counts = []
+        for script in (make_script(owner, 'small', stages=1, tasks=1), make_script(owner, 'large', stages=5, tasks=6)):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/api/script/%d/export' % script.id, {'token': token})
+            self.assertEqual(response.status_code, 200)
+            query_counts.append(len(queries))
+
+        self.assertIn('job-4-5', response.json()['script'])
+        self.assertEqual(query_counts[0], query_counts[1])
+
+
+class TreeTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user@example.com', 'user@example.com', PASSWORD)
+        self.token = issue_token(self.user)
+        self.script = make_script(self.user, stages=2, tasks=1)
+
+    def tree(self, **params):
+        return self.client.get('/api/script/%d/tree' % self.script.id, dict(params, token=self.token))
+
+    def parameters(self, response):
+        return [
+            parameter
+            for stage in response.json()['Stages'] for task in stage['Tasks'] for parameter in task['Parameters']
+        ]
+
+    def test_all_parameter_fields_by_default(self):
+        parameter = self.parameters(self.tree())[0]
+        self.assertEqual(set(parameter), {'id', 'name', 'value', 'parsed'})
+        self.assertEqual((parameter['value'], parameter['parsed']), ('make 0\r\nmake check', ['make 0', 'make check']))
+
+    def test_parameter_fields_are_projected(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.tree(parameter_fields='name,parsed')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.parameters(response), [
+            {'name': 'script', 'parsed': ['make 0', 'make check']},
+            {'name': 'only', 'parsed': ['master', 'tags']},
+        ] * 2)
+        self.assertFalse(any('"api_parameter"."value"' in query['sql'] for query in queries))
+        self.assertNotEqual(response['ETag'], self.tree()['ETag'])
+
+    def test_unknown_parameter_field_is_rejected(self):
+        self.assertEqual(self.tree(parameter_fields='name,task_id').status_code, 400)
+
+
+class BatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user@example.com', 'user@example.com', PASSWORD)
+
+    def create_scripts(self, *titles):
+        return apply_operations(self.user, [
+            {'action': 'create', 'model': 'script', 'fields': {'title': title}} for title in titles
+        ])
+
+    def test_conflict_reports_the_duplicate_operation(self):
+        with self.assertRaises(BatchError) as raised:
+            self.create_scripts('build', 'deploy', 'build')
+        self.assertEqual(raised.exception.index, 2)
+        self.assertFalse(Script.objects.exists())
+
+    def test_conflict_with_existing_name_reports_its_operation(self):
+        Script.objects.create(title='deploy', owner=self.user)
+        with self.assertRaises(BatchError) as raised:
+            self.create_scripts('build', 'test', 'deploy', 'lint')
+        self.assertEqual(raised.exception.index, 2)
+        self.assertEqual(Script.objects.count(), 1)
+
+    def test_temp_ids_resolve_across_operations(self):
+        results = apply_operations(self.user, [
+            {'action': 'create', 'model': 'script', 'temp_id': 's', 'fields': {'title': 'build'}},
+            {'action': 'create', 'model': 'stage', 'temp_id': 't',
+             'fields': {'name': 'test', 'order': 0, 'script_id': 's'}},
+            {'action': 'create', 'model': 'task', 'temp_id': 7, 'fields': {'name': 'unit', 'stage_id': 't'}},
+            {'action': 'create', 'model': 'parameter', 'fields': {'name': 'script', 'value': 'make', 'task_id': '7'}},
+        ])
+        parameter = Parameter.objects.get(id=results[3]['id'])
+        self.assertEqual(parameter.task_id, results[2]['id'])
+        self.assertEqual(parameter.task.stage_id, results[1]['id'])
+        self.assertEqual(parameter.task.stage.script_id, results[0]['id'])
+        self.assertEqual(results[2]['temp_id'], 7)
+
+    def test_temp_id_of_another_model_is_rejected(self):
+        with self.assertRaises(BatchError) as raised:
+            apply_operations(self.user, [
+                {'action': 'create', 'model': 'script', 'temp_id': 's', 'fields': {'title': 'build'}},
+                {'action': 'create', 'model': 'task', 'fields': {'name': 'unit', 'stage_id': 's'}},
+            ])
+        self.assertEqual(raised.exception.index, 1)
+
+    def test_mixed_operations(self):
+        script = make_script(self.user, stages=2, tasks=1)
+        first, second = script.stage_set.order_by('order')
+        apply_operations(self.user, [
+            {'action': 'save', 'model': 'script', 'id': script.id, 'fields': {'title': 'release'}},
+            {'action': 'create', 'model': 'task', 'fields': {'name': 'lint', 'stage_id': first.id}},
+            {'action': 'save', 'model': 'stage', 'id': first.id, 'fields': {'name': 'check'}},
+            {'action': 'remove', 'model': 'stage', 'id': second.id},
+        ])
+        script.refresh_from_db()
+        self.assertEqual(script.title, 'release')
+        self.assertEqual(list(script.stage_set.values_list('name', flat=True)), ['check'])
+        self.assertEqual(sorted(Task.objects.values_list('name', flat=True)), ['job-0-0', 'lint'])
+        self.assertFalse(Parameter.objects.filter(task__stage_id=second.id).exists())
+
+    def test_failing_operation_rolls_back_the_batch(self):
+        script = make_script(self.user, stages=1, tasks=1)
+        with self.assertRaises(BatchError) as raised:
+            apply_operations(self.user, [
+                {'action': 'save', 'model': 'script', 'id': script.id, 'fields': {'title': 'release'}},
+                {'action': 'create', 'model': 'script', 'fields': {'title': 'build'}},
+                {'action': 'remove', 'model': 'task', 'id': Task.objects.get().id},
+                {'action': 'remove', 'model': 'stage', 'id': 0},
+            ])
+        self.assertEqual((raised.exception.index, raised.exception.status), (3, 404))
+        self.assertEqual(list(Script.objects.values_list('title', flat=True)), ['pipeline'])
+        self.assertEqual(Task.objects.count(), 1)
+
+    def test_non_scalar_values_are_rejected(self):
+        token = issue_token(self.user)
+        for operation in (
+            {'action': 'create', 'model': 'script', 'fields': {'title': ['build']}},
+            {'action': 'create', 'model': 'script', 'fields': {'title': True}},
+            {'action': 'create', 'model': 'script', 'temp_id': [1], 'fields': {'title': 'build'}},
+        ):
+            response = self.client.post('/api/batch', {'token': token, 'operations': json.dumps([operation])})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['index'], 0)
+        self.assertFalse(Script.objects.exists())
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user@example.com', 'user@example.com', PASSWORD)
+        self.token = issue_token(self.user)
+        for index in range(5):
+            Script.objects.create(title='script-%d' % index, owner=self.user)
+
+    @override_settings(API_MAX_PAGE_SIZE=2)
+    def test_listing_without_limit_is_paged(self):
+        titles = []
+        cursor = ''
+        while cursor is not None:
+            response = self.client.get('/api/script', {'token': self.token, 'cursor': cursor}).json()
+            self.assertLessEqual(len(response['Scripts']), 2)
+            titles += [script['title'] for script in response['Scripts']]
+            cursor = response['next_cursor']
+        self.assertEqual(titles, ['script-%d' % index for index in range(5)])
+
+
+class ListingETagTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user@example.com', 'user@example.com', PASSWORD)
+        self.token = issue_token(self.user)
+        self.script = make_script(self.user, stages=1, tasks=1)
+        self.stage = self.script.stage_set.get()
+        self.task = self.stage.task_set.get()
+
+    def check_listing(self, url, params, write):
+        params = dict(params, token=self.token)
+        etag = self.client.get(url, params)['ETag']
+        self.assertEqual(self.client.get(url, params, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.assertEqual(write().status_code, 200)
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.client.get(url, params, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_scripts(self):
+        self.check_listing('/api/script', {}, lambda: self.client.post(
+            '/api/script/%d/save' % self.script.id, {'token': self.token, 'title': 'release'}))
+
+    def test_stages(self):
+        self.check_listing('/api/stage', {'script_id': self.script.id}, lambda: self.client.post(
+            '/api/stage/create', {'token': self.token, 'name': 'deploy', 'order': 1, 'script_id': self.script.id}))
+
+    def test_tasks(self):
+        self.check_listing('/api/task', {'stage_id': self.stage.id}, lambda: self.client.post(
+            '/api/task/%d/save' % self.task.id, {'token': self.token, 'name': 'lint', 'stage_id': self.stage.id}))
+
+    def test_parameters(self):
+        parameter = self.task.parameter_set.get(name='only')
+        self.check_listing('/api/parameter', {'task_id': self.task.id}, lambda: self.client.post(
+            '/api/parameter/%d/remove' % parameter.id, {'token': self.token}))
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        # Test rollbacks reuse script ids, and with them export cache keys.
+        caches['exports'].clear()
+        self.user = User.objects.create_user('user@example.com', 'user@example.com', PASSWORD)
+        self.token = issue_token(self.user)
+        self.script = make_script(self.user, stages=2, tasks=2)
+
+    def export(self, headers=None, **params):
+        return self.client.post(
+            '/api/script/%d/export' % self.script.id, dict(params, token=self.token), **(headers or {}))
+
+    def test_etag_depends_on_format(self):
+        json_etag = self.export()['ETag']
+        yaml_etag = self.export(format='yaml')['ETag']
+        self.assertNotEqual(json_etag, yaml_etag)
+
+        response = self.export(format='yaml', headers={'HTTP_IF_NONE_MATCH': json_etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/yaml')
+
+    def test_import_of_export_round_trips(self):
+        exported = b''.join(self.export(format='yaml'))
+
+        response = self.client.post('/api/script/import', {
+            'token': self.token, 'title': 'imported', 'yaml': exported.decode(),
+        }).json()
+        self.assertEqual(response['skipped'], [])
+
+        self.script = Script.objects.get(id=response['script_id'])
+        self.assertEqual(b''.join(self.export(format='yaml')), exported)
+
+    def test_every_write_invalidates_the_export(self):
+        stages = list(Stage.objects.filter(script=self.script).order_by('order'))
+        task = Task.objects.filter(stage=stages[0]).first()
+
+        def last(model):
+            return model.objects.order_by('-id').first().id
+
+        writes = [
+            lambda: ('script/%d/save' % self.script.id, {'title': 'renamed'}),
+            lambda: ('script/%d/reorder' % self.script.id, {'stage_ids': json.dumps([stages[1].id, stages[0].id])}),
+            lambda: ('stage/%d/save' % stages[0].id, {'name': 'build', 'order': 1, 'script_id': self.script.id}),
+            lambda: ('task/%d/save' % task.id, {'name': 'compile', 'stage_id': stages[0].id}),
+            lambda: ('task/create', {'name': 'lint', 'stage_id': stages[0].id}),
+            lambda: ('parameter/create', {'name': 'script', 'value': 'make lint', 'task_id': last(Task)}),
+            lambda: ('parameter/%d/save' % last(Parameter), {'name': 'script', 'value': 'lint', 'task_id': last(Task)}),
+            lambda: ('parameter/%d/remove' % last(Parameter), {}),
+            lambda: ('task/%d/remove' % last(Task), {}),
+            lambda: ('batch', {'operations': json.dumps([
+                {'action': 'create', 'model': 'task', 'temp_id': 't',
+                 'fields': {'name': 'x', 'stage_id': task.stage_id}},
+                {'action': 'create', 'model': 'parameter', 'fields': {'name': 'script', 'value': 'x', 'task_id': 't'}},
+            ])}),
+            lambda: ('stage/%d/remove' % stages[1].id, {}),
+        ]
+        for write in writes:
+            path, data = write()
+            etag = self.export()['ETag']
+            response = self.client.post('/api/' + path, dict(data, token=self.token))
+            self.assertEqual(response.status_code, 200, path)
+
+            response = self.export(headers={'HTTP_IF_NONE_MATCH': etag})
+            self.assertEqual(response.status_code, 200, path)
+            self.assertNotEqual(response['ETag'], etag, path)
+            self.assertEqual(response.json()['script'], render_script(Script.objects.get(id=self.script.id)), path)
+
+        response = self.client.post('/api/stage/create', {
+            'token': self.token, 'name': 'empty', 'order': 3, 'script_id': self.script.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.export(headers={'HTTP_IF_NONE_MATCH': etag}).status_code, 404)
+
+    def test_title_save_keeps_concurrent_version_bumps(self):
+        script = Script.objects.get(id=self.script.id)
+        Script.objects.filter(id=script.id).update(version=10)
+        with mock.patch('api.views.Script.objects.get', return_value=script):
+            self.client.post('/api/script/%d/save' % script.id, {'token': self.token, 'title': 'renamed'})
+        script.refresh_from_db()
+        self.assertEqual((script.title, script.version), ('renamed', 11))
+
+    def test_delta_from_before_pruned_tombstones_is_a_full_export(self):
+        since = Script.objects.get(id=self.script.id).version
+        task = Task.objects.filter(stage__script=self.script).first()
+        self.client.post('/api/task/%d/remove' % task.id, {'token': self.token})
+        self.assertEqual(self.export(since=since).json()['removed'], [task.name])
+
+        RemovedTask.objects.update(created=timezone.now() - timedelta(days=365))
+        call_command('purgescripts', stdout=io.StringIO())
+        self.assertFalse(RemovedTask.objects.exists())
+
+        self.assertIn('script', self.export(since=since).json())
+        version = Script.objects.get(id=self.script.id).version
+        self.assertEqual(self.export(since=version).json()['removed'], [])
+
+
+class CloneTests(TestCase):
+    def tree(self, script):
+        ids = set()
+        tree = []
+        for stage in load_script_tree(script):
+            ids.add(('stage', stage.id))
+            tree.append((stage.name, stage.order, []))
+            for task in stage.tasks:
+                ids.add(('task', task.id))
+                tree[-1][2].append((task.name, []))
+                for parameter in task.parameters:
+                    ids.add(('parameter', parameter.id))
+                    tree[-1][2][-1][1].append((parameter.name, parameter.value, parameter.parsed))
+        return tree, ids
+
+    def test_clone_copies_the_tree(self):
+        user = User.objects.create_user('user@example.com', 'user@example.com', PASSWORD)
+        script = make_script(user, stages=3, tasks=2)
+        # Orders out of id order, with a gap.
+        Stage.objects.filter(script=script, name='stage-0').update(order=7)
+        source_tree, source_ids = self.tree(script)
+
+        response = self.client.post('/api/script/%d/clone' % script.id, {'token': issue_token(user), 'title': 'copy'})
+        self.assertEqual(response.status_code, 200)
+        clone = Script.objects.get(id=response.json()['script_id'])
+        clone_tree, clone_ids = self.tree(clone)
+
+        self.assertEqual((clone.title, clone.owner_id), ('copy', user.id))
+        self.assertEqual([stage[0] for stage in clone_tree], ['stage-1', 'stage-2', 'stage-0'])
+        self.assertEqual(clone_tree, source_tree)
+        self.assertFalse(clone_ids & source_ids)
+        self.assertEqual(len(clone_ids), len(source_ids))
+        self.assertEqual(self.tree(script), (source_tree, source_ids))
+        self.assertEqual(Script.objects.get(id=script.id).title, 'pipeline')
+
+
+class ReorderTests(TestCase):
+    def setUp(self):
+        caches['exports'].clear()
+        self.user = User.objects.create_user('user@example.com', 'user@example.com', PASSWORD)
+        self.token = issue_token(self.user)
+        self.script = make_script(self.user, stages=3, tasks=1)
+        self.stage_ids = list(self.script.stage_set.order_by('order').values_list('id', flat=True))
+
+    def reorder(self, stage_ids):
+        return self.client.post(
+            '/api/script/%d/reorder' % self.script.id, {'token': self.token, 'stage_ids': json.dumps(stage_ids)})
+
+    def stage_order(self):
+        return list(self.script.stage_set.order_by('order').values_list('id', flat=True))
+
+    def test_stages_take_the_given_order(self):
+        stage_ids = self.stage_ids[::-1]
+        response = self.reorder(stage_ids)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stage_order(), stage_ids)
+        self.assertEqual(list(self.script.stage_set.order_by('order').values_list('order', flat=True)), [0, 1, 2])
+
+    def test_foreign_or_missing_stage_ids_are_rejected(self):
+        foreign_id = make_script(self.user, 'other', stages=1, tasks=1).stage_set.get().id
+        for stage_ids in (self.stage_ids[:2] + [foreign_id], self.stage_ids[:2], self.stage_ids + [foreign_id]):
+            self.assertEqual(self.reorder(stage_ids).status_code, 400)
+        self.assertEqual(self.stage_order(), self.stage_ids)
+
+    def test_reorder_bumps_the_version_and_etags(self):
+        export_etag = self.client.post('/api/script/%d/export' % self.script.id, {'token': self.token})['ETag']
+        tree_etag = self.client.get('/api/script/%d/tree' % self.script.id, {'token': self.token})['ETag']
+        version = self.script.version
+
+        self.reorder(self.stage_ids[1:] + self.stage_ids[:1])
+        self.assertGreater(Script.objects.get(id=self.script.id).version, version)
+
+        response = self.client.post(
+            '/api/script/%d/export' % self.script.id, {'token': self.token}, HTTP_IF_NONE_MATCH=export_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(response.json()['script'].index('stage-1'), response.json()['script'].index('stage-0'))
+        response = self.client.get(
+            '/api/script/%d/tree' % self.script.id, {'token': self.token}, HTTP_IF_NONE_MATCH=tree_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], tree_etag)
+
+
+class ParsedParameterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user@example.com', 'user@example.com', PASSWORD)
+        self.task = make_script(self.user, stages=1, tasks=1).stage_set.get().task_set.get()
+
+    def parsed(self):
+        return {
+            name: json.loads(parsed)
+            for name, parsed in Parameter.objects.filter(task=self.task).values_list('name', 'parsed')
+        }
+
+    def test_parsed_on_save(self):
+        Parameter.objects.create(name='image', value='python:3', task=self.task)
+        Parameter.objects.create(name='when', value='', task=self.task)
+        self.assertEqual(self.parsed(), {
+            'script': ['make 0', 'make check'],
+            'only': ['master', 'tags'],
+            'image': 'python:3',
+            'when': None,
+        })
+
+        parameter = Parameter.objects.get(task=self.task, name='only')
+        response = self.client.post('/api/parameter/%d/save' % parameter.id, {
+            'token': issue_token(self.user), 'name': 'only', 'value': 'master;;dev, tags', 'task_id': self.task.id,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.parsed()['only'], ['master', 'dev', 'tags'])
+
+    def test_migration_backfills_parsed(self):
+        migration = import_module('api.migrations.0007_parameter_parsed')
+        Parameter.objects.create(name='image', value='python:3', task=self.task)
+        expected = self.parsed()
+        Parameter.objects.update(parsed='null')
+
+        with mock.patch.object(migration, 'BACKFILL_BATCH_SIZE', 2):
+            migration.backfill_parsed(apps, None)
+        self.assertEqual(self.parsed(), expected)
+
+
+class EmitterTests(SimpleTestCase):
+    SCALARS = [
+        'build', 'make test', 'yes', 'no', 'null', '~', 'true', 'off', '-', '- item', '-x', ':', ':key', '#',
+        '# comment', 'a #b', 'key: value', 'trailing:', 'trailing ', '123', '0x1f', '1e3', '.5', '1_000',
+        '2026-10-18', '12:30', 'first\nsecond', 'line\r\nbreak', 'caf\xe9', '\u6d4b\u8bd5', '---', '...',
+        '', ' leading', 'quote\'s', '"quoted"', 'x' * 90, ' '.join(['word'] * 20),
+    ]
+
+    def test_stages_match_pyyaml(self):
+        for name in self.SCALARS:
+            stages = ['build', name]
+            self.assertEqual(emit_stages(stages), yaml.safe_dump({'stages': stages}), repr(name))
+
+    def test_tasks_match_pyyaml(self):
+        for value in self.SCALARS:
+            for task_name, fields in (
+                    ('job', [('script', value)]),
+                    ('job', [('only', ['master', value]), ('stage', 'test')]),
+                    (value or 'job', [('script', 'make')]),
+                    ('job', [(value or 'key', 'make')])):
+                self.assertEqual(
+                    emit_task(task_name, fields),
+                    yaml.safe_dump({task_name: dict(fields)}, sort_keys=False), repr(value))
+
+    def test_plain_task(self):
+        self.assertEqual(
+            emit_task('unit', [('stage', 'test'), ('script', ['make', 'make check']), ('when', 'manual')]),
+            'unit:\n  stage: test\n  script:\n  - make\n  - make check\n  when: manual\n')
+
+
+class ExportJobTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user@example.com', 'user@example.com', PASSWORD)
+        self.token = issue_token(self.user)
+        self.scripts = [make_script(self.user, title='script-%d' % index, stages=1, tasks=1) for index in range(2)]
+
+    def create_job(self, **fields):
+        return ExportJob.objects.create(
+            owner=self.user, script_ids=','.join(str(script.id) for script in self.scripts),
+            heartbeat=timezone.now(), **fields)
+
+    def get_job(self, job):
+        return self.client.get('/api/export/%d' % job.id, {'token': self.token}).json()
+
+    def test_script_deleted_after_queueing_is_reported(self):
+        job = self.create_job()
+        Script.objects.filter(id=self.scripts[1].id).update(deleted=True)
+
+        run_export_job(job.id)
+
+        response = self.get_job(job)
+        self.assertEqual(response['status'], ExportJob.DONE)
+        self.assertEqual(response['errors'], {str(self.scripts[1].id): 'Incorrect script id'})
+
+    def test_lost_jobs_are_failed(self):
+        stale = timezone.now() - timedelta(hours=1)
+        pending = self.create_job(process='gone')
+        running = self.create_job()
+        ExportJob.objects.filter(id=pending.id).update(heartbeat=stale)
+        ExportJob.objects.filter(id=running.id).update(status=ExportJob.RUNNING, heartbeat=stale)
+        fresh = self.create_job()
+
+        self.assertEqual(self.get_job(pending)['status'], ExportJob.FAILED)
+        response = self.client.get('/api/export/%d/download' % running.id, {'token': self.token})
+        self.assertEqual(json.loads(response.content)['status'], ExportJob.FAILED)
+        self.assertEqual(self.get_job(fresh)['status'], ExportJob.PENDING)
+
+    def test_jobs_queued_behind_busy_workers_are_kept(self):
+        stale = timezone.now() - timedelta(hours=1)
+        running = self.create_job()
+        queued = self.create_job(process=PROCESS_ID)
+        other = self.create_job(process='other')
+        ExportJob.objects.update(created=stale, heartbeat=stale)
+
+        run_export_job(running.id)
+
+        self.assertEqual(self.get_job(queued)['status'], ExportJob.PENDING)
+        self.assertEqual(self.get_job(other)['status'], ExportJob.FAILED)
+        run_export_job(queued.id)
+        self.assertEqual(self.get_job(queued)['status'], ExportJob.DONE)
+
+
+DEPLOY_YAML = """\
+stages:
+- deploy
+release job:
+  stage: deploy
+  script:
+  - ./scripts/deploy.sh prod
+  - make
+"""
+
+
+class RecordingCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = []
+
+    def execute(self, sql, params):
+        self.executed.append((sql, params))
+
+    def fetchall(self):
+        return self.rows
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(email, email, PASSWORD) for email in ('a@example.com', 'b@example.com')
+        ]
+        self.tokens = [issue_token(user) for user in self.users]
+
+    def post(self, path, user=0, **data):
+        response = self.client.post('/api/' + path, dict(data, token=self.tokens[user]))
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def search(self, query, user=0, **params):
+        return self.client.get('/api/search', dict(params, q=query, token=self.tokens[user])).json()
+
+    def found(self, query, user=0):
+        return {(result['model'], result['text']) for result in self.search(query, user)['Results']}
+
+    def test_index_follows_writes(self):
+        script_id = self.post('script/import', title='Deploy pipeline', yaml=DEPLOY_YAML)['script_id']
+        other_id = self.post('script/create', user=1, title='other deploy')['script_id']
+        stage = Stage.objects.get(script_id=script_id)
+        task = Task.objects.get(stage=stage)
+        parameter = Parameter.objects.get(task=task)
+
+        self.assertEqual(self.found('deploy.sh'), {('parameter', './scripts/deploy.sh prod\r\nmake')})
+        self.assertEqual(self.found('DEPLOY'), {
+            ('script', 'Deploy pipeline'), ('stage', 'deploy'), ('parameter', './scripts/deploy.sh prod\r\nmake'),
+        })
+        self.assertEqual(self.found('deploy', user=1), {('script', 'other deploy')})
+        self.assertEqual(self.found('release jo'), {('task', 'release job')})
+
+        self.post('parameter/%d/save' % parameter.id, name='script', value='helm upgrade', task_id=task.id)
+        self.assertEqual(self.found('deploy.sh'), set())
+        self.assertEqual(self.found('helm'), {('parameter', 'helm upgrade')})
+
+        self.post('batch', operations=json.dumps([
+            {'action': 'save', 'model': 'task', 'id': task.id, 'fields': {'name': 'ship it'}},
+        ]))
+        self.assertEqual(self.found('ship'), {('task', 'ship it')})
+
+        self.post('stage/%d/save' % stage.id, name='deploy', order=0, script_id=other_id)
+        self.assertEqual(self.found('helm'), set())
+        self.assertEqual(self.found('helm', user=1), {('parameter', 'helm upgrade')})
+
+        self.post('parameter/%d/remove' % parameter.id, user=1)
+        self.assertEqual(self.found('helm', user=1), set())
+
+        self.post('script/%d/remove' % other_id, user=1, soft='true')
+        self.assertEqual(self.found('deploy', user=1), set())
+        purge_deleted_scripts()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT body FROM api_search')
+            self.assertEqual(cursor.fetchall(), [('Deploy pipeline',)])
+
+    def test_pages_follow_the_index(self):
+        script_id = self.post('script/create', title='npm pipeline')['script_id']
+        stage_id = self.post('stage/create', name='build', order=0, script_id=script_id)['stage_id']
+        self.post('batch', operations=json.dumps([
+            {'action': 'create', 'model': 'task', 'fields': {'name': 'job %d npm' % index, 'stage_id': stage_id}}
+            for index in range(25)
+        ]))
+
+        texts = []
+        cursor = ''
+        while cursor is not None:
+            response = self.search('npm', limit=10, cursor=cursor)
+            self.assertLessEqual(len(response['Results']), 10)
+            texts += [result['text'] for result in response['Results']]
+            cursor = response['next_cursor']
+        self.assertEqual(texts, [result['text'] for result in self.search('npm', limit=30)['Results']])
+        self.assertCountEqual(texts, ['npm pipeline'] + ['job %d npm' % index for index in range(25)])
+
+    def test_results_are_ranked_by_relevance(self):
+        script_id = self.post('script/create', title='release pipeline')['script_id']
+        stage_id = self.post('stage/create', name='ship', order=0, script_id=script_id)['stage_id']
+        for name in ('lint the helm charts before the helm release', 'helm', 'helm lint'):
+            self.post('task/create', name=name, stage_id=stage_id)
+
+        texts = [result['text'] for result in self.search('helm')['Results']]
+        self.assertEqual(texts, ['helm', 'helm lint', 'lint the helm charts before the helm release'])
+        with mock.patch('api.search._has_sqlite_index', return_value=False):
+            self.assertEqual([result['text'] for result in self.search('HELM')['Results']], texts)
+            self.assertEqual(self.found('helm lint'), {
+                ('task', 'helm lint'), ('task', 'lint the helm charts before the helm release'),
+            })
+
+    def test_short_terms_only_filter(self):
+        self.post('script/create', title='npm build')
+        self.post('script/create', title='npm test')
+        self.assertEqual(self.search('np')['error'], 'Search terms need at least 3 characters')
+        self.assertEqual(self.found('npm bu'), {('script', 'npm build')})
+        self.assertEqual(self.found('m_b'), set())
+        self.assertEqual(self.search('npm', cursor=1)['Results'], self.search('npm')['Results'][1:])
+
+    def test_postgresql_query(self):
+        user = self.users[0]
+        cursor = RecordingCursor([(7, 3, 'deploy'), (2 * KEY_STRIDE + 9, 3, 'deploy job')])
+
+        rows = _search_postgresql(cursor, user, ['Deploy', '50%'], 5, 21)
+
+        self.assertEqual(rows, cursor.rows)
+        (sql, params), = cursor.executed
+        self.assertEqual(sql.count('%s'), len(params))
+        self.assertEqual(sql.count('ILIKE %s'), 8)
+        self.assertIn('api_task.id + %d' % (2 * KEY_STRIDE), sql)
+        self.assertTrue(sql.endswith('ORDER BY similarity(body, %s) DESC, key LIMIT %s OFFSET %s'))
+        self.assertEqual(params, [user.id, '%Deploy%', '%50\\%%'] * 4 + ['Deploy 50%', 21, 5])
+
+
+class DeletionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user@example.com', 'user@example.com', PASSWORD)
+        self.token = issue_token(self.user)
+
+    def test_trees_are_deleted_without_loading_them(self):
+        scripts = [make_script(self.user, title='script-%d' % index) for index in range(2)]
+        kept = make_script(self.user, title='kept', stages=1, tasks=1)
+
+        with CaptureQueriesContext(connection) as queries:
+            delete_trees(Script, [script.id for script in scripts])
+
+        statements = {query['sql'].split()[0] for query in queries if 'api_' in query['sql']}
+        self.assertEqual(statements, {'DELETE'})
+        self.assertEqual(list(Script.all_objects.all()), [kept])
+        self.assertEqual(Parameter.objects.count(), 2)
+
+    def test_soft_deleted_scripts_are_purged_by_the_command(self):
+        script = make_script(self.user, stages=1, tasks=1)
+        self.client.post('/api/script/%d/remove' % script.id, {'token': self.token, 'soft': 'true'})
+        self.assertFalse(Script.objects.exists())
+        self.assertTrue(Parameter.objects.exists())
+
+        out = io.StringIO()
+        call_command('purgescripts', stdout=out)
+        self.assertIn('Purged 1 scripts.', out.getvalue())
+        self.assertFalse(Script.all_objects.exists())
+        self.assertFalse(Parameter.objects.exists())
+
+    def test_children_of_soft_deleted_scripts_are_not_found(self):
+        script = make_script(self.user, stages=1, tasks=1)
+        stage = Stage.objects.get()
+        task = Task.objects.get()
+        parameter = Parameter.objects.filter(task=task).first()
+        self.client.post('/api/script/%d/remove' % script.id, {'token': self.token, 'soft': 'true'})
+
+        requests = [
+            ('get', 'task', {'stage_id': stage.id}),
+            ('get', 'parameter', {'task_id': task.id}),
+            ('post', 'task/create', {'name': 'new', 'stage_id': stage.id}),
+            ('post', 'task/%d/save' % task.id, {'name': 'new', 'stage_id': stage.id}),
+            ('post', 'parameter/create', {'name': 'new', 'task_id': task.id}),
+            ('post', 'parameter/%d/remove' % parameter.id, {}),
+            ('post', 'stage/%d/remove' % stage.id, {}),
+            ('post', 'batch', {'operations': json.dumps([
+                {'action': 'create', 'model': 'task', 'fields': {'name': 'new', 'stage_id': stage.id}}])}),
+        ]
+        for method, path, data in requests:
+            response = getattr(self.client, method)('/api/' + path, dict(data, token=self.token))
+            self.assertEqual(response.status_code, 404, path)
+        self.assertEqual(Task.objects.count(), 1)
+
+    def test_tasks_of_soft_deleted_scripts_can_be_touched(self):
+        script = make_script(self.user, stages=1, tasks=1)
+        task = Task.objects.get()
+        Script.all_objects.filter(id=script.id).update(deleted=True)
+        touch_scripts(script.id, tasks=[task.id])
+        task.refresh_from_db()
+        self.assertEqual(task.version, 2)
+
+
+class ChangeFeedTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user@example.com', 'user@example.com', PASSWORD)
+        self.token = issue_token(self.user)
+
+    def log(self, count, owner=None):
+        return [
+            ChangeLog.objects.create(owner=owner or self.user, script_id=1, model='script', object_id=1, action='save')
+            for _ in range(count)
+        ]
+
+    def feed(self, headers=None, **params):
+        return self.client.get('/api/changes', dict(params, token=self.token), **(headers or {}))
+
+    @override_settings(CHANGES_MAX_WAITERS=0)
+    def test_waiters_beyond_the_cap_are_turned_away(self):
+        response = self.feed(since=0, wait=1)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response['Retry-After'], '5')
+
+        self.log(1)
+        self.assertEqual(len(self.feed(since=0, wait=1).json()['changes']), 1)
+
+        response = self.feed(since=0, headers={'HTTP_ACCEPT': 'text/event-stream'})
+        self.assertEqual(b''.join(response.streaming_content), b'retry: 5000\n\n')
+
+    def test_old_changes_are_pruned_by_the_command(self):
+        old = self.log(3)
+        ChangeLog.objects.update(created=timezone.now() - timedelta(days=8))
+        new = self.log(1)
+
+        out = io.StringIO()
+        call_command('purgescripts', stdout=out)
+        self.assertIn('Pruned 3 change log entries.', out.getvalue())
+        self.assertEqual(list(ChangeLog.objects.all()), new)
+
+        response = self.feed(since=old[0].id)
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(response.json(), {'error': 'This cursor has expired'})
+        self.assertEqual(self.feed(since=old[-1].id).json()['changes'][0]['id'], new[0].id)
+        self.assertEqual(self.feed().json()['cursor'], new[0].id)
+
+    def test_idle_cursor_keeps_up_with_pruning(self):
+        other = User.objects.create_user('other@example.com', 'other@example.com', PASSWORD)
+        cursor = self.feed().json()['cursor']
+        changes = self.log(3, owner=other)
+
+        response = self.feed(since=cursor).json()
+        self.assertEqual((response['changes'], response['cursor']), ([], changes[-1].id))
+
+        ChangeLog.objects.update(created=timezone.now() - timedelta(days=8))
+        self.log(1, owner=other)
+        call_command('purgescripts', stdout=io.StringIO())
+        self.assertEqual(self.feed(since=cursor).status_code, 410)
+        self.assertEqual(self.feed(since=response['cursor']).status_code, 200)
+
+    @override_settings(CHANGES_STREAM_SECONDS=0.05, CHANGES_POLL_INTERVAL=0.01)
+    def test_idle_stream_moves_the_event_id(self):
+        other = User.objects.create_user('other@example.com', 'other@example.com', PASSWORD)
+        change, = self.log(1, owner=other)
+        response = self.feed(since=0, headers={'HTTP_ACCEPT': 'text/event-stream'})
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'id: %d\n: keepalive\n\n' % change.id))
+
+    def test_newest_change_is_kept(self):
+        change, = self.log(1)
+        ChangeLog.objects.update(created=timezone.now() - timedelta(days=8))
+        call_command('purgescripts', stdout=io.StringIO())
+        self.assertEqual(list(ChangeLog.objects.all()), [change])
+
+
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        sticky = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}
+        overridden = override_settings(DATABASE_REPLICAS=['replica1'], CACHES=dict(settings.CACHES, sticky=sticky))
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+
+    def route(self, read_only, user_id=1):
+        databases = []
+
+        def view():
+            databases.append(router.db_for_read(Script))
+            return HttpResponse()
+
+        call_routed(User(id=user_id), read_only, view)
+        return databases[0]
+
+    def test_reads_go_to_a_replica(self):
+        self.assertEqual(self.route(read_only=True), 'replica1')
+        self.assertEqual(self.route(read_only=False), 'default')
+
+    def test_reads_after_a_write_go_to_the_primary(self):
+        self.route(read_only=False)
+        self.assertEqual(self.route(read_only=True), 'default')
+        self.assertEqual(self.route(read_only=True, user_id=2), 'replica1')
+
+    def test_stickiness_is_shared_between_processes(self):
+        self.route(read_only=False)
+        with mock.patch('api.routers.caches', CacheHandler()):
+            self.assertEqual(self.route(read_only=True), 'default')
+
+    def test_stickiness_expires(self):
+        with self.settings(DATABASE_STICKY_SECONDS=-1):
+            self.route(read_only=False)
+        self.assertEqual(self.route(read_only=True), 'replica1')
+
+
+@skipUnless('replica1' in settings.DATABASES, 'VCIM_DB_REPLICAS is not set')
+class ReplicaTests(TransactionTestCase):
+    databases = {'default', 'replica1'}
+
+    def setUp(self):
+        caches[settings.DATABASE_STICKY_CACHE].clear()
+        self.user = User.objects.create_user('user@example.com', 'user@example.com', PASSWORD)
+        self.token = issue_token(self.user)
+
+    def test_listing_reads_from_the_replica_until_a_write(self):
+        with override_settings(DATABASE_REPLICAS=['replica1']):
+            with CaptureQueriesContext(connections['replica1']) as queries:
+                self.client.get('/api/script', {'token': self.token})
+            self.assertTrue(queries)
+
+            self.client.post('/api/script/create', {'token': self.token, 'title': 'build'})
+            with CaptureQueriesContext(connections['replica1']) as queries:
+                response = self.client.get('/api/script', {'token': self.token})
+            self.assertFalse(queries)
+            self.assertEqual(len(response.json()['Scripts']), 1)
+
+
+class ASGITests(SimpleTestCase):
+    @staticmethod
+    def echo_form(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'application/json')])
+        return [json.dumps(WSGIRequest(environ).POST.dict()).encode()]
+
+    def post(self, headers, *chunks):
+        messages = [
+            {'type': 'http.request', 'body': chunk, 'more_body': index < len(chunks) - 1}
+            for index, chunk in enumerate(chunks)
+        ]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        application = WSGIToASGI(self.echo_form, max_workers=1)
+        scope = {'type': 'http', 'method': 'POST', 'path': '/', 'headers': headers}
+        asyncio.run(application(scope, receive, send))
+        application.executor.shutdown()
+        return json.loads(b''.join(message.get('body', b'') for message in sent[1:]))
+
+    def test_chunked_form_is_read(self):
+        headers = [
+            (b'content-type', b'application/x-www-form-urlencoded'),
+            (b'transfer-encoding', b'chunked'),
+        ]
+        self.assertEqual(self.post(headers, b'email=a%40b.c&pass', b'word=secret'),
+                         {'email': 'a@b.c', 'password': 'secret'})
+
+
+@override_settings(DATABASE_HEALTH_CHECK_IDLE=30)
+class ConnectionCheckTests(TestCase):
+    def check(self, idle, usable):
+        connection.ensure_connection()
+        connection.last_used = time.monotonic() - idle
+        with mock.patch.dict(connection.settings_dict, CONN_HEALTH_CHECKS=True), \
+                mock.patch.object(connection, 'is_usable', return_value=usable) as is_usable, \
+                mock.patch.object(connection, 'close') as close:
+            check_connections()
+        return is_usable.called, close.called
+
+    def test_busy_connection_is_not_pinged(self):
+        self.assertEqual(self.check(idle=0, usable=False), (False, False))
+
+    def test_idle_connection_is_pinged(self):
+        self.assertEqual(self.check(idle=60, usable=True), (True, False))
+        self.assertEqual(self.check(idle=60, usable=False), (True, True))
+
+    def test_queries_record_use(self):
+        connection.last_used = 0
+        Script.objects.exists()
+        self.assertGreater(connection.last_used, time.monotonic() - 30)
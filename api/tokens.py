@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.utils import baseconv, timezone
+from django.utils.crypto import constant_time_compare, get_random_string, salted_hmac
+
+from .models import RevokedToken
+
+TOKEN_SALT = 'api.tokens'
+
+# token_id -> (token, user id, cached until). Entries live at most
+# API_TOKEN_CACHE_TTL seconds, which bounds how long a token revoked by
+# another process keeps working here. The user is loaded on every request,
+# so deactivating a user or changing their password takes effect at once.
+_verified_tokens = OrderedDict()
+_verified_tokens_lock = threading.Lock()
+
+
+def _signer():
+    return signing.TimestampSigner(salt=TOKEN_SALT)
+
+
+def _password_fragment(user):
+    """Bind a token to the password hash, so a password change invalidates it."""
+    return salted_hmac(TOKEN_SALT, user.password).hexdigest()[:16]
+
+
+def _parse_token(token):
+    try:
+        payload, timestamp, _ = token.rsplit(':', 2)
+        user_id, token_id, fragment = payload.split(':')
+        return int(user_id), token_id, fragment, baseconv.base62.decode(timestamp)
+    except ValueError:
+        return None
+
+
+def issue_token(user):
+    token_id = get_random_string(32)
+    return _signer().sign('%d:%s:%s' % (user.id, token_id, _password_fragment(user)))
+
+
+def get_request_token(request, params):
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if header.startswith('Token '):
+        return header[len('Token '):].strip()
+    return params.get('token')
+
+
+def verify_token(token):
+    parsed = _parse_token(token)
+    if parsed is None:
+        return None
+    user_id, token_id, fragment, issued = parsed
+
+    now = time.time()
+    verified = False
+    with _verified_tokens_lock:
+        entry = _verified_tokens.get(token_id)
+        if entry is not None:
+            cached_token, _, cached_until = entry
+            if cached_until <= now:
+                del _verified_tokens[token_id]
+            elif constant_time_compare(cached_token, token):
+                _verified_tokens.move_to_end(token_id)
+                verified = True
+
+    if not verified:
+        try:
+            _signer().unsign(token, max_age=settings.API_TOKEN_MAX_AGE)
+        except signing.BadSignature:
+            return None
+
+        if RevokedToken.objects.filter(token_id=token_id).exists():
+            return None
+
+    try:
+        user = User.objects.get(id=user_id, is_active=True)
+    except User.DoesNotExist:
+        return None
+    if not constant_time_compare(fragment, _password_fragment(user)):
+        return None
+
+    if not verified:
+        cached_until = min(now + settings.API_TOKEN_CACHE_TTL, issued + settings.API_TOKEN_MAX_AGE)
+        with _verified_tokens_lock:
+            _verified_tokens[token_id] = (token, user_id, cached_until)
+            _verified_tokens.move_to_end(token_id)
+            while len(_verified_tokens) > settings.API_TOKEN_CACHE_SIZE:
+                _verified_tokens.popitem(last=False)
+
+    return user
+
+
+def revoke_token(token):
+    parsed = _parse_token(token)
+    if parsed is None:
+        return False
+    _, token_id, _, issued = parsed
+
+    try:
+        _signer().unsign(token, max_age=settings.API_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+
+    now = timezone.now()
+    expires = datetime.fromtimestamp(issued + settings.API_TOKEN_MAX_AGE, tz=timezone.utc)
+    RevokedToken.objects.filter(expires__lt=now).delete()
+    RevokedToken.objects.get_or_create(token_id=token_id, defaults={'expires': expires})
+
+    with _verified_tokens_lock:
+        _verified_tokens.pop(token_id, None)
+
+    return True
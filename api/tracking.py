@@ -0,0 +1,62 @@
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery
+from django.db.models.functions import Greatest
+
+from .models import ChangeLog, RemovedTask, Script, Task
+from .search import update_search_index
+
+
+def touch_scripts(*script_ids, tasks=(), stages=(), stage_lists=(), removed_tasks=()):
+    """Bump the version of every given script after a write under it.
+
+    For delta exports the new version is also stamped on what the write
+    changed: the tasks with ids in ``tasks``, all tasks of the stages in
+    ``stages``, the stage list of the scripts in ``stage_lists``, and a
+    tombstone for every ``(script id, task name)`` in ``removed_tasks``.
+    The scripts of ``tasks`` and ``stages`` must be among ``script_ids``.
+    """
+    script_ids = set(script_ids) | set(stage_lists) | {script_id for script_id, _ in removed_tasks}
+    Script.all_objects.filter(id__in=script_ids).update(version=F('version') + 1)
+    if stage_lists:
+        Script.all_objects.filter(id__in=set(stage_lists)).update(stages_version=F('version'))
+    if tasks or stages:
+        Task.objects.filter(Q(id__in=set(tasks)) | Q(stage_id__in=set(stages))).update(version=Subquery(
+            Script.all_objects.filter(stage=OuterRef('stage_id')).values('version')[:1]))
+    if removed_tasks:
+        versions = dict(Script.all_objects.filter(id__in=script_ids).values_list('id', 'version'))
+        RemovedTask.objects.bulk_create([
+            RemovedTask(script_id=script_id, name=name, version=versions[script_id])
+            for script_id, name in set(removed_tasks)
+            if script_id in versions
+        ])
+
+
+def prune_removed_tasks(before):
+    """Delete the tombstones recorded before ``before`` and return how many were deleted.
+
+    Every script keeps the highest version it lost tombstones of, so that a
+    delta export from an older version falls back to a full export.
+    """
+    pruned = RemovedTask.objects.filter(created__lt=before)
+    with transaction.atomic():
+        Script.all_objects.filter(id__in=pruned.values('script_id')).update(removed_tasks_pruned=Greatest(
+            F('removed_tasks_pruned'),
+            Subquery(pruned.filter(script=OuterRef('id')).order_by('-version').values('version')[:1])))
+        deleted, _ = pruned.delete()
+    return deleted
+
+
+def log_changes(*changes):
+    """Append ``(script id, model name, object id, action)`` entries to the change feed.
+
+    Entries are filed under the owner of their script, so a removed script
+    must be logged before it is deleted. Repeated entries are logged once.
+    Created and saved objects are also written to the search index.
+    """
+    owners = dict(Script.all_objects.filter(id__in={change[0] for change in changes}).values_list('id', 'owner_id'))
+    ChangeLog.objects.bulk_create([
+        ChangeLog(owner_id=owners[script_id], script_id=script_id, model=model, object_id=object_id, action=action)
+        for script_id, model, object_id, action in dict.fromkeys(changes)
+        if script_id in owners
+    ])
+    update_search_index(changes)
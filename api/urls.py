@@ -5,13 +5,26 @@ from . import views
 urlpatterns = [
     path('register', views.register),
     path('login', views.login),
+    path('logout', views.logout),
+    path('batch', views.apply_batch),
+    path('metrics', views.get_metrics),
+    path('changes', views.get_change_feed),
+    path('search', views.search),
 
     path('script', views.get_scripts),
     path('script/create', views.create_script),
+    path('script/import', views.import_script),
     path('script/<int:script_id>/save', views.save_script),
+    path('script/<int:script_id>/reorder', views.reorder_stages),
+    path('script/<int:script_id>/clone', views.clone_script),
     path('script/<int:script_id>/export', views.export_script),
+    path('script/<int:script_id>/tree', views.get_script_tree),
     path('script/<int:script_id>/remove', views.remove_script),
 
+    path('export/create', views.create_export_job),
+    path('export/<int:job_id>', views.get_export_job),
+    path('export/<int:job_id>/download', views.download_export_job),
+
     path('stage', views.get_stages),
     path('stage/create', views.create_stage),
     path('stage/<int:stage_id>/save', views.save_stage),
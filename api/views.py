@@ -1,39 +1,75 @@
-import operator
-import re
-from collections import OrderedDict
+import json
+from functools import wraps
 
-import yamlordereddictloader
+from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
-from django.http import JsonResponse
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max, Sum
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import HttpResponse
-from yaml import Dumper, dump
 
-from .models import Parameter, Script, Stage, Task
+from .batch import BatchError, apply_operations
+from .changes import cursor_expired, get_changes, latest_cursor, stream_changes, wait_for_changes
+from .cloning import copy_script
+from .conditional import if_none_match, make_etag
+from .deletion import delete_trees, soft_delete_script
+from .exports import ExportError, cached_render_script, get_cached_export, render_script_delta, stream_script
+from .imports import ScriptImportError, create_script_from_yaml
+from .instrumentation import metrics, timed
+from .jobs import fail_stale_jobs, get_script_ids, start_export_job
+from .loaders import load_script_tree
+from .models import ExportJob, Parameter, Script, Stage, Task
+from .pagination import get_page_params, keyset_page
+from .routers import call_routed
+from .search import search_scripts
+from .tokens import get_request_token, issue_token, revoke_token, verify_token
+from .tracking import log_changes, touch_scripts
+
+PARAMETER_FIELDS = ('id', 'name', 'value', 'parsed')
+
+
+def authenticate_user(http_method, read_only=None):
+    """Authenticate the view by token or email and password.
+
+    GET views, and POST views marked ``read_only``, read from a replica.
+    """
+    if read_only is None:
+        read_only = http_method == 'GET'
 
-
-def authenticate_user(http_method):
     def decorator(func):
+        @wraps(func)
         def wrapper(request, *args, **kwargs):
             if http_method == 'GET':
-                user_email = request.GET.get('email')
-                user_password = request.GET.get('password')
+                params = request.GET
             else:
-                user_email = request.POST.get('email')
-                user_password = request.POST.get('password')
+                params = request.POST
+
+            token = get_request_token(request, params)
+            if token:
+                with timed('auth'):
+                    user = verify_token(token)
+                if user is None:
+                    return JsonResponse({'error': 'Invalid or expired token'}, status=401)
+                request.user = user
+                return call_routed(user, read_only, func, request, *args, **kwargs)
+
+            user_email = params.get('email')
+            user_password = params.get('password')
 
             if not user_email or not user_password:
                 return JsonResponse({
                     'error': 'Missing field',
                 }, status=400)
 
-            user = authenticate(username=user_email, password=user_password)
+            with timed('auth'):
+                user = authenticate(username=user_email, password=user_password)
             if user is None:
                 return JsonResponse({'error': 'Incorrect email or password'}, status=401)
             request.user = user
-            return func(request, *args, **kwargs)
+            return call_routed(user, read_only, func, request, *args, **kwargs)
         return wrapper
     return decorator
 
@@ -88,20 +124,182 @@ def login(request):
 
     return JsonResponse({
         'user_id': user.id,
+        'token': issue_token(user),
+        'expires_in': settings.API_TOKEN_MAX_AGE,
+    })
+
+
+@authenticate_user(http_method='POST')
+def logout(request):
+    token = get_request_token(request, request.POST)
+
+    if not token:
+        return JsonResponse({
+            'error': 'Missing field',
+        }, status=400)
+
+    revoke_token(token)
+
+    return JsonResponse({
+        'user_id': request.user.id,
+    })
+
+
+@authenticate_user(http_method='POST')
+def apply_batch(request):
+    operations = request.POST.get('operations')
+
+    if not operations:
+        return JsonResponse({
+            'error': 'Missing field',
+        }, status=400)
+
+    try:
+        operations = json.loads(operations)
+    except ValueError:
+        operations = None
+
+    if not isinstance(operations, list):
+        return JsonResponse({
+            'error': 'Incorrect data type operations',
+        }, status=400)
+
+    if len(operations) > settings.BATCH_MAX_OPERATIONS:
+        return JsonResponse({
+            'error': 'Too many operations',
+        }, status=400)
+
+    try:
+        results = apply_operations(request.user, operations)
+    except BatchError as error:
+        return JsonResponse({
+            'error': str(error),
+            'index': error.index,
+        }, status=error.status)
+
+    return JsonResponse({
+        'results': results,
+    })
+
+
+@authenticate_user(http_method='GET')
+def get_metrics(request):
+    if not request.user.is_staff:
+        return JsonResponse({
+            'error': 'Staff only',
+        }, status=403)
+
+    return JsonResponse({
+        'views': metrics.snapshot(),
     })
 
+
+@authenticate_user(http_method='GET')
+def get_change_feed(request):
+    since = request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get('since')
+    wait = request.GET.get('wait')
+
+    try:
+        since = int(since) if since else None
+    except ValueError:
+        return JsonResponse({
+            'error': 'Incorrect data type since',
+        }, status=400)
+
+    try:
+        wait = min(float(wait), settings.CHANGES_MAX_WAIT) if wait else 0
+    except ValueError:
+        return JsonResponse({
+            'error': 'Incorrect data type wait',
+        }, status=400)
+
+    if since is None:
+        since = latest_cursor()
+    elif cursor_expired(since):
+        return JsonResponse({
+            'error': 'This cursor has expired',
+        }, status=410)
+
+    if 'text/event-stream' in request.META.get('HTTP_ACCEPT', ''):
+        response = StreamingHttpResponse(stream_changes(request.user, since), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    if wait > 0:
+        result = wait_for_changes(request.user, since, wait)
+        if result is None:
+            response = HttpResponse(status=204)
+            response['Retry-After'] = settings.CHANGES_RETRY_AFTER
+            return response
+        changes, cursor, more = result
+    else:
+        changes, cursor, more = get_changes(request.user, since)
+
+    return JsonResponse({
+        'changes': changes,
+        'cursor': cursor,
+        'more': more,
+    })
+
+
+@authenticate_user(http_method='GET')
+def search(request):
+    query = request.GET.get('q', '').strip()
+
+    if not query:
+        return JsonResponse({
+            'error': 'Missing field',
+        }, status=400)
+
+    try:
+        cursor, limit = get_page_params(request.GET)
+    except ValueError as error:
+        return JsonResponse({
+            'error': str(error),
+        }, status=400)
+
+    try:
+        results, next_cursor = search_scripts(request.user, query, cursor, limit)
+    except ValueError as error:
+        return JsonResponse({
+            'error': str(error),
+        }, status=400)
+
+    return JsonResponse({
+        'Results': results,
+        'next_cursor': next_cursor,
+    })
+
+
 @authenticate_user(http_method='GET')
 def get_scripts(request):
+    try:
+        cursor, limit = get_page_params(request.GET)
+    except ValueError as error:
+        return JsonResponse({
+            'error': str(error),
+        }, status=400)
+
     user_scripts = Script.objects.filter(owner=request.user)
 
-    dict_user_scripts = {'Scripts':[]}
-    if not user_scripts:
-        return JsonResponse(dict_user_scripts)
+    # Creating a script raises the max id, removing one lowers the count
+    # and saving one raises the version sum, so any change alters the ETag.
+    validator = user_scripts.aggregate(count=Count('id'), last_id=Max('id'), versions=Sum('version'))
+    etag = make_etag('scripts', request.user.id, validator['count'], validator['last_id'],
+                     validator['versions'], cursor, limit)
+    not_modified = if_none_match(request, etag)
+    if not_modified:
+        return not_modified
 
-    for script in user_scripts:
-        dict_user_scripts['Scripts'].append({'id':script.id, 'title': script.title})
+    user_scripts, next_cursor = keyset_page(user_scripts, ('id', 'title'), cursor, limit)
 
-    return JsonResponse(dict_user_scripts)
+    response = JsonResponse({
+        'Scripts': user_scripts,
+        'next_cursor': next_cursor,
+    })
+    response['ETag'] = etag
+    return response
 
 
 @authenticate_user(http_method='POST')
@@ -114,20 +312,50 @@ def create_script(request):
         }, status=400)
 
     try:
-        script = Script.objects.get(title=title_script, owner=request.user)
-    except Script.DoesNotExist:
-        script = None
+        with transaction.atomic():
+            script = Script.objects.create(title=title_script, owner=request.user)
+            log_changes((script.id, 'script', script.id, 'create'))
+    except IntegrityError:
+        return JsonResponse({
+            'error': 'This title is already in use',
+        }, status=400)
 
-    if script is None:
-        script = Script(title=title_script, owner=request.user)
-        script.save()
+    return JsonResponse({
+        'script_id': script.id,
+    })
+
+
+@authenticate_user(http_method='POST')
+def import_script(request):
+    title_script = request.POST.get('title')
+    upload = request.FILES.get('file')
+    if upload is not None:
+        try:
+            text = upload.read().decode('utf-8')
+        except UnicodeDecodeError:
+            return JsonResponse({
+                'error': 'Incorrect file encoding',
+            }, status=400)
     else:
+        text = request.POST.get('yaml')
+
+    if not title_script or not text:
         return JsonResponse({
-            'error': 'This title is already in use',
+            'error': 'Missing field',
+        }, status=400)
+
+    try:
+        with transaction.atomic():
+            script, skipped = create_script_from_yaml(request.user, title_script, text)
+            log_changes((script.id, 'script', script.id, 'create'))
+    except ScriptImportError as error:
+        return JsonResponse({
+            'error': str(error),
         }, status=400)
 
     return JsonResponse({
         'script_id': script.id,
+        'skipped': skipped,
     })
 
 
@@ -147,28 +375,80 @@ def save_script(request, script_id):
             'error': 'Incorrect script id',
         }, status=404)
 
-    scripts_user = Script.objects.filter(owner=request.user)
-    if scripts_user:
-        try:
-            script_equal_title = scripts_user.get(title=new_title_script)
-        except Script.DoesNotExist:
-            script_equal_title = None
-        if script_equal_title and script.title != new_title_script:
+    script.title = new_title_script
+    try:
+        with transaction.atomic():
+            script.save(update_fields=['title'])
+            touch_scripts(script.id)
+            log_changes((script.id, 'script', script.id, 'save'))
+    except IntegrityError:
+        return JsonResponse({
+            'error': 'This title is already in use',
+        }, status=400)
+
+    return JsonResponse({
+        'script_id': script.id,
+    })
+
+
+@authenticate_user(http_method='POST')
+def reorder_stages(request, script_id):
+    stage_ids = request.POST.get('stage_ids')
+
+    if not stage_ids:
+        return JsonResponse({
+            'error': 'Missing field',
+        }, status=400)
+
+    try:
+        stage_ids = json.loads(stage_ids)
+    except ValueError:
+        stage_ids = None
+
+    if not isinstance(stage_ids, list) or not all(isinstance(stage_id, int) for stage_id in stage_ids):
+        return JsonResponse({
+            'error': 'Incorrect data type stage_ids',
+        }, status=400)
+
+    try:
+        script = Script.objects.get(id=script_id)
+    except Script.DoesNotExist:
+        return JsonResponse({
+            'error': 'Incorrect script id',
+        }, status=404)
+
+    with transaction.atomic():
+        orders = dict(Stage.objects.select_for_update().filter(script=script).values_list('id', 'order'))
+        if len(stage_ids) != len(orders) or set(stage_ids) != set(orders):
             return JsonResponse({
-                'error': 'This title is already in use',
+                'error': 'Stage ids dont match the stages of this script',
             }, status=400)
 
-
-    script.title = new_title_script
-    script.save()
+        changed = [
+            Stage(id=stage_id, order=order)
+            for order, stage_id in enumerate(stage_ids)
+            if orders[stage_id] != order
+        ]
+        if changed:
+            Stage.objects.bulk_update(changed, ['order'])
+            touch_scripts(script.id, stage_lists=[script.id])
+            log_changes(*((script.id, 'stage', stage.id, 'save') for stage in changed))
 
     return JsonResponse({
         'script_id': script.id,
+        'stage_ids': stage_ids,
     })
 
 
 @authenticate_user(http_method='POST')
-def export_script(request, script_id):
+def clone_script(request, script_id):
+    title_script = request.POST.get('title')
+
+    if not title_script:
+        return JsonResponse({
+            'error': 'Missing field',
+        }, status=400)
+
     try:
         script = Script.objects.get(id=script_id)
     except Script.DoesNotExist:
@@ -176,55 +456,128 @@ def export_script(request, script_id):
             'error': 'Incorrect script id',
         }, status=404)
 
-    script_stages = Stage.objects.filter(script=script)
-    if not script_stages:
+    try:
+        with transaction.atomic():
+            clone = copy_script(script, request.user, title_script)
+            log_changes((clone.id, 'script', clone.id, 'create'))
+    except IntegrityError:
         return JsonResponse({
-            'error': 'This script doesnt have stages',
+            'error': 'This title is already in use',
+        }, status=400)
+
+    return JsonResponse({
+        'script_id': clone.id,
+    })
+
+
+@authenticate_user(http_method='POST', read_only=True)
+def export_script(request, script_id):
+    try:
+        script = Script.objects.get(id=script_id)
+    except Script.DoesNotExist:
+        return JsonResponse({
+            'error': 'Incorrect script id',
         }, status=404)
 
-    for stage in script_stages:
-        stage_tasks = Task.objects.filter(stage=stage)
-        if not stage_tasks:
+    since = request.POST.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
             return JsonResponse({
-                'error': 'Stage doesnt have tasks',
-            }, status=404)
-
-    dict_stages = {'stages' : []}
-    sorted_script_stages = sorted(script_stages, key=operator.attrgetter('order'))
-    for stage in sorted_script_stages:
-        dict_stages['stages'].append(stage.name)
-    all_stages = dump(dict_stages, Dumper=Dumper)
-    all_stages += '\n'
-
-    all_dump_tasks = []
-    for stage in sorted_script_stages:
-        stage_tasks = Task.objects.filter(stage=stage)
-        if stage_tasks:
-            for task in stage_tasks:
-                dict_task = OrderedDict()
-                dict_task[task.name] = OrderedDict([('stage', stage.name)])
-                task_parameters = Parameter.objects.filter(task=task)
-                if task_parameters:
-                    for parameter in task_parameters:
-                        if parameter.name == 'script' and parameter.value:
-                            values = parameter.value.split('\r\n')
-                            dict_task[task.name][parameter.name] = [value for value in values if value]
-                        elif parameter.name == 'only' and parameter.value:
-                            values = re.split('[ ;,]', parameter.value)
-                            dict_task[task.name][parameter.name] = [value for value in values if value]
-                        elif parameter.value:
-                            dict_task[task.name][parameter.name] = parameter.value
-                    all_dump_tasks.append(dump(dict_task, Dumper=yamlordereddictloader.Dumper))
-                    all_dump_tasks[-1] += '\n'
-
-    all_tasks = ''
-    for dump_task in all_dump_tasks:
-        all_tasks += dump_task
-    script = all_stages + all_tasks
+                'error': 'Incorrect data type since',
+            }, status=400)
 
-    return JsonResponse({
+    # The tombstones a delta from ``since`` needs may have been pruned.
+    if since is not None and since < script.removed_tasks_pruned:
+        since = None
+
+    export_format = 'yaml' if request.POST.get('format') == 'yaml' else 'json'
+    if since is None:
+        etag = make_etag('export', export_format, script.id, script.version)
+    else:
+        etag = make_etag('export-delta', script.id, script.version, since)
+    not_modified = if_none_match(request, etag)
+    if not_modified:
+        return not_modified
+
+    if since is not None:
+        response = JsonResponse(render_script_delta(script, since))
+        response['ETag'] = etag
+        return response
+
+    if export_format == 'yaml':
+        export = get_cached_export(script)
+        if export is not None:
+            response = HttpResponse(export, content_type='text/yaml')
+        else:
+            try:
+                response = StreamingHttpResponse(stream_script(script), content_type='text/yaml')
+            except ExportError as error:
+                return JsonResponse({
+                    'error': str(error),
+                }, status=404)
+        response['ETag'] = etag
+        return response
+
+    try:
+        script = cached_render_script(script)
+    except ExportError as error:
+        return JsonResponse({
+            'error': str(error),
+        }, status=404)
+
+    response = JsonResponse({
         'script': script,
     })
+    response['ETag'] = etag
+    return response
+
+
+@authenticate_user(http_method='GET')
+def get_script_tree(request, script_id):
+    parameter_fields = request.GET.get('parameter_fields')
+
+    if parameter_fields:
+        parameter_fields = parameter_fields.split(',')
+        if not set(parameter_fields) <= set(PARAMETER_FIELDS):
+            return JsonResponse({
+                'error': 'Incorrect parameter fields',
+            }, status=400)
+    else:
+        parameter_fields = PARAMETER_FIELDS
+
+    try:
+        script = Script.objects.get(id=script_id)
+    except Script.DoesNotExist:
+        return JsonResponse({
+            'error': 'Incorrect script id',
+        }, status=404)
+
+    etag = make_etag('tree', script.id, script.version, ','.join(parameter_fields))
+    not_modified = if_none_match(request, etag)
+    if not_modified:
+        return not_modified
+
+    script_stages = load_script_tree(
+        script, deferred=[field for field in ('value', 'parsed') if field not in parameter_fields])
+
+    dict_script_tree = {'id': script.id, 'title': script.title, 'Stages': []}
+    for stage in script_stages:
+        dict_stage_tasks = []
+        for task in stage.tasks:
+            dict_task_parameters = []
+            for parameter in task.parameters:
+                dict_parameter = {field: getattr(parameter, field) for field in parameter_fields}
+                if 'parsed' in dict_parameter:
+                    dict_parameter['parsed'] = json.loads(dict_parameter['parsed'])
+                dict_task_parameters.append(dict_parameter)
+            dict_stage_tasks.append({'id': task.id, 'name': task.name, 'Parameters': dict_task_parameters})
+        dict_script_tree['Stages'].append({'id': stage.id, 'name': stage.name, 'order': stage.order, 'Tasks': dict_stage_tasks})
+
+    response = JsonResponse(dict_script_tree)
+    response['ETag'] = etag
+    return response
 
 
 @authenticate_user(http_method='POST')
@@ -236,13 +589,98 @@ def remove_script(request, script_id):
             'error': 'Incorrect script id',
         }, status=404)
 
-    script.delete()
+    with transaction.atomic():
+        log_changes((script.id, 'script', script.id, 'remove'))
+        if request.POST.get('soft') in ('1', 'true'):
+            soft_delete_script(script)
+        else:
+            delete_trees(Script, [script.id])
 
     return JsonResponse({
         'script_id': script_id,
     })
 
 
+@authenticate_user(http_method='POST')
+def create_export_job(request):
+    script_ids = request.POST.get('script_ids')
+
+    if not script_ids:
+        return JsonResponse({
+            'error': 'Missing field',
+        }, status=400)
+
+    try:
+        script_ids = json.loads(script_ids)
+    except ValueError:
+        script_ids = None
+
+    if not isinstance(script_ids, list) or not script_ids or \
+            not all(isinstance(script_id, int) for script_id in script_ids):
+        return JsonResponse({
+            'error': 'Incorrect data type script_ids',
+        }, status=400)
+
+    script_ids = sorted(set(script_ids))
+    if len(script_ids) > settings.EXPORT_JOB_MAX_SCRIPTS:
+        return JsonResponse({
+            'error': 'Too many scripts',
+        }, status=400)
+
+    if Script.objects.filter(id__in=script_ids).count() != len(script_ids):
+        return JsonResponse({
+            'error': 'Incorrect script id',
+        }, status=404)
+
+    job = start_export_job(request.user, script_ids)
+
+    return JsonResponse({
+        'job_id': job.id,
+        'status': job.status,
+    })
+
+
+@authenticate_user(http_method='GET')
+def get_export_job(request, job_id):
+    fail_stale_jobs(ExportJob.objects.filter(id=job_id, owner=request.user))
+    try:
+        job = ExportJob.objects.defer('result').get(id=job_id, owner=request.user)
+    except ExportJob.DoesNotExist:
+        return JsonResponse({
+            'error': 'Incorrect job id',
+        }, status=404)
+
+    return JsonResponse({
+        'job_id': job.id,
+        'status': job.status,
+        'script_ids': get_script_ids(job),
+        'errors': json.loads(job.errors) if job.errors else {},
+        'created': job.created,
+        'finished': job.finished,
+    })
+
+
+@authenticate_user(http_method='GET')
+def download_export_job(request, job_id):
+    fail_stale_jobs(ExportJob.objects.filter(id=job_id, owner=request.user))
+    try:
+        job = ExportJob.objects.get(id=job_id, owner=request.user)
+    except ExportJob.DoesNotExist:
+        return JsonResponse({
+            'error': 'Incorrect job id',
+        }, status=404)
+
+    if job.status != ExportJob.DONE:
+        return JsonResponse({
+            'error': 'This job is not finished',
+            'status': job.status,
+        }, status=409)
+
+    response = HttpResponse(bytes(job.result), content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="export-%d.zip"' % job.id
+    return response
+
+
 @authenticate_user(http_method='GET')
 def get_stages(request):
     script_id = request.GET.get('script_id')
@@ -260,22 +698,33 @@ def get_stages(request):
         }, status=400)
 
     try:
-        script = Script.objects.get(id=script_id)
+        cursor, limit = get_page_params(request.GET)
+    except ValueError as error:
+        return JsonResponse({
+            'error': str(error),
+        }, status=400)
+
+    try:
+        script_version = Script.objects.values_list('version', flat=True).get(id=script_id)
     except Script.DoesNotExist:
         return JsonResponse({
             'error': 'Incorrect script id',
         }, status=404)
 
-    script_stages = Stage.objects.filter(script=script)
+    etag = make_etag('stages', script_id, script_version, cursor, limit)
+    not_modified = if_none_match(request, etag)
+    if not_modified:
+        return not_modified
 
-    dict_script_stages = {'Stages': []}
-    if not script_stages:
-        return JsonResponse(dict_script_stages)
+    script_stages, next_cursor = keyset_page(
+        Stage.objects.filter(script_id=script_id), ('id', 'name', 'order'), cursor, limit)
 
-    for stage in script_stages:
-        dict_script_stages['Stages'].append({'id': stage.id, 'name': stage.name, 'order': stage.order})
-
-    return JsonResponse(dict_script_stages)
+    response = JsonResponse({
+        'Stages': script_stages,
+        'next_cursor': next_cursor,
+    })
+    response['ETag'] = etag
+    return response
 
 
 @authenticate_user(http_method='POST')
@@ -316,14 +765,11 @@ def create_stage(request):
         }, status=404)
 
     try:
-        stage = Stage.objects.get(name=name_stage, script=script)
-    except Stage.DoesNotExist:
-        stage = None
-
-    if stage is None:
-        stage = Stage(name=name_stage, order=order_stage, script=script)
-        stage.save()
-    else:
+        with transaction.atomic():
+            stage = Stage.objects.create(name=name_stage, order=order_stage, script=script)
+            touch_scripts(script.id, stage_lists=[script.id])
+            log_changes((script.id, 'stage', stage.id, 'create'))
+    except IntegrityError:
         return JsonResponse({
             'error': 'This name is already in use',
         }, status=400)
@@ -371,27 +817,31 @@ def save_stage(request, stage_id):
         }, status=404)
 
     try:
-        stage = Stage.objects.get(id=stage_id)
+        stage = Stage.objects.get(id=stage_id, script__deleted=False)
     except Stage.DoesNotExist:
         return JsonResponse({
             'error': 'Incorrect stage id',
         }, status=404)
 
-    script_stages = Stage.objects.filter(script=script)
-    if script_stages:
-        try:
-            stages_equal_name = script_stages.filter(name=new_name_stage)
-        except Stage.DoesNotExist:
-            stages_equal_name = None
-        if (stages_equal_name and stage not in stages_equal_name) or (stages_equal_name and stage in stages_equal_name and stages_equal_name.count() > 1):
-            return JsonResponse({
-                'error': 'This name is already in use',
-            }, status=400)
+    old_script_id = stage.script_id
+    renamed = stage.name != new_name_stage or old_script_id != script.id
+    removed_tasks = []
+    if old_script_id != script.id:
+        removed_tasks = [(old_script_id, name) for name in stage.task_set.values_list('name', flat=True)]
 
     stage.name = new_name_stage
     stage.order = order_stage
     stage.script = script
-    stage.save()
+    try:
+        with transaction.atomic():
+            stage.save()
+            touch_scripts(old_script_id, script.id, stages=[stage.id] if renamed else [],
+                          stage_lists=[old_script_id, script.id], removed_tasks=removed_tasks)
+            log_changes((old_script_id, 'stage', stage.id, 'save'), (script.id, 'stage', stage.id, 'save'))
+    except IntegrityError:
+        return JsonResponse({
+            'error': 'This name is already in use',
+        }, status=400)
 
     return JsonResponse({
         'stage_id': stage.id,
@@ -401,13 +851,17 @@ def save_stage(request, stage_id):
 @authenticate_user(http_method='POST')
 def remove_stage(request, stage_id):
     try:
-        stage = Stage.objects.get(id=stage_id)
+        stage = Stage.objects.get(id=stage_id, script__deleted=False)
     except Stage.DoesNotExist:
         return JsonResponse({
             'error': 'Incorrect stage id',
         }, status=404)
 
-    stage.delete()
+    removed_tasks = [(stage.script_id, name) for name in stage.task_set.values_list('name', flat=True)]
+    with transaction.atomic():
+        delete_trees(Stage, [stage.id])
+        touch_scripts(stage.script_id, stage_lists=[stage.script_id], removed_tasks=removed_tasks)
+        log_changes((stage.script_id, 'stage', stage_id, 'remove'))
 
     return JsonResponse({
         'stage_id': stage_id,
@@ -431,22 +885,34 @@ def get_tasks(request):
         }, status=400)
 
     try:
-        stage = Stage.objects.get(id=stage_id)
+        cursor, limit = get_page_params(request.GET)
+    except ValueError as error:
+        return JsonResponse({
+            'error': str(error),
+        }, status=400)
+
+    try:
+        script_version = Stage.objects.values_list('script__version', flat=True).get(
+            id=stage_id, script__deleted=False)
     except Stage.DoesNotExist:
         return JsonResponse({
             'error': 'Incorrect stage id',
         }, status=404)
 
-    stage_tasks = Task.objects.filter(stage=stage)
-
-    dict_stage_tasks = {'Tasks': []}
-    if not stage_tasks:
-        return JsonResponse(dict_stage_tasks)
+    etag = make_etag('tasks', stage_id, script_version, cursor, limit)
+    not_modified = if_none_match(request, etag)
+    if not_modified:
+        return not_modified
 
-    for task in stage_tasks:
-        dict_stage_tasks['Tasks'].append({'id': task.id, 'name': task.name})
+    stage_tasks, next_cursor = keyset_page(
+        Task.objects.filter(stage_id=stage_id), ('id', 'name'), cursor, limit)
 
-    return JsonResponse(dict_stage_tasks)
+    response = JsonResponse({
+        'Tasks': stage_tasks,
+        'next_cursor': next_cursor,
+    })
+    response['ETag'] = etag
+    return response
 
 
 @authenticate_user(http_method='POST')
@@ -467,22 +933,21 @@ def create_task(request):
         }, status=400)
 
     try:
-        stage = Stage.objects.get(id=stage_id)
+        stage = Stage.objects.get(id=stage_id, script__deleted=False)
     except Stage.DoesNotExist:
         return JsonResponse({
             'error': 'Incorrect stage id',
         }, status=404)
 
-    stage_tasks = Task.objects.filter(stage=stage)
-    if stage_tasks:
-        task_equal_name = stage_tasks.filter(name=name_task)
-        if task_equal_name:
-            return JsonResponse({
-                'error': 'This name is already in use',
-            }, status=400)
-
-    task = Task(name=name_task, stage=stage)
-    task.save()
+    try:
+        with transaction.atomic():
+            task = Task.objects.create(name=name_task, stage=stage)
+            touch_scripts(stage.script_id, tasks=[task.id])
+            log_changes((stage.script_id, 'task', task.id, 'create'))
+    except IntegrityError:
+        return JsonResponse({
+            'error': 'This name is already in use',
+        }, status=400)
 
     return JsonResponse({
         'task_id': task.id,
@@ -507,33 +972,35 @@ def save_task(request, task_id):
         }, status=400)
 
     try:
-        stage = Stage.objects.get(id=stage_id)
+        stage = Stage.objects.get(id=stage_id, script__deleted=False)
     except Stage.DoesNotExist:
         return JsonResponse({
             'error': 'Incorrect stage id',
         }, status=404)
 
     try:
-        task = Task.objects.get(id=task_id)
+        task = Task.objects.select_related('stage').get(id=task_id, stage__script__deleted=False)
     except Task.DoesNotExist:
         return JsonResponse({
             'error': 'Incorrect task id',
         }, status=404)
 
-    stage_tasks = Task.objects.filter(stage=stage)
-    if stage_tasks:
-        try:
-            tasks_equal_name = stage_tasks.filter(name=new_name_task)
-        except Task.DoesNotExist:
-            tasks_equal_name = None
-        if (tasks_equal_name and task not in tasks_equal_name) or (tasks_equal_name and task in tasks_equal_name and tasks_equal_name.count() > 1):
-            return JsonResponse({
-                'error': 'This name is already in use',
-            }, status=400)
+    old_script_id = task.stage.script_id
+    removed_tasks = []
+    if task.name != new_name_task or old_script_id != stage.script_id:
+        removed_tasks = [(old_script_id, task.name)]
 
     task.name = new_name_task
     task.stage = stage
-    task.save()
+    try:
+        with transaction.atomic():
+            task.save()
+            touch_scripts(old_script_id, stage.script_id, tasks=[task.id], removed_tasks=removed_tasks)
+            log_changes((old_script_id, 'task', task.id, 'save'), (stage.script_id, 'task', task.id, 'save'))
+    except IntegrityError:
+        return JsonResponse({
+            'error': 'This name is already in use',
+        }, status=400)
 
     return JsonResponse({
         'task_id': task.id,
@@ -543,13 +1010,16 @@ def save_task(request, task_id):
 @authenticate_user(http_method='POST')
 def remove_task(request, task_id):
     try:
-        task = Task.objects.get(id=task_id)
+        task = Task.objects.select_related('stage').get(id=task_id, stage__script__deleted=False)
     except Task.DoesNotExist:
         return JsonResponse({
             'error': 'Incorrect task id',
         }, status=404)
 
-    task.delete()
+    with transaction.atomic():
+        delete_trees(Task, [task.id])
+        touch_scripts(task.stage.script_id, removed_tasks=[(task.stage.script_id, task.name)])
+        log_changes((task.stage.script_id, 'task', task_id, 'remove'))
 
     return JsonResponse({
         'task_id': task_id,
@@ -573,28 +1043,42 @@ def get_parameters(request):
         }, status=400)
 
     try:
-        task = Task.objects.get(id=task_id)
+        cursor, limit = get_page_params(request.GET)
+    except ValueError as error:
+        return JsonResponse({
+            'error': str(error),
+        }, status=400)
+
+    try:
+        script_version = Task.objects.values_list('stage__script__version', flat=True).get(
+            id=task_id, stage__script__deleted=False)
     except Task.DoesNotExist:
         return JsonResponse({
             'error': 'Incorrect task id',
         }, status=404)
 
-    task_parameters = Parameter.objects.filter(task=task)
-
-    dict_task_parameters = {'Parameters': []}
-    if not task_parameters:
-        return JsonResponse(dict_task_parameters)
+    etag = make_etag('parameters', task_id, script_version, cursor, limit)
+    not_modified = if_none_match(request, etag)
+    if not_modified:
+        return not_modified
 
+    task_parameters, next_cursor = keyset_page(
+        Parameter.objects.filter(task_id=task_id), PARAMETER_FIELDS, cursor, limit)
     for parameter in task_parameters:
-        dict_task_parameters['Parameters'].append({'id': parameter.id, 'name': parameter.name, 'value': parameter.value})
+        parameter['parsed'] = json.loads(parameter['parsed'])
 
-    return JsonResponse(dict_task_parameters)
+    response = JsonResponse({
+        'Parameters': task_parameters,
+        'next_cursor': next_cursor,
+    })
+    response['ETag'] = etag
+    return response
 
 
 @authenticate_user(http_method='POST')
 def create_parameter(request):
     name_parameter = request.POST.get('name')
-    value_parameter = request.POST.get('value')
+    value_parameter = request.POST.get('value', '')
     task_id = request.POST.get('task_id')
 
     if not name_parameter or not task_id:
@@ -610,22 +1094,21 @@ def create_parameter(request):
         }, status=400)
 
     try:
-        task = Task.objects.get(id=task_id)
+        task = Task.objects.select_related('stage').get(id=task_id, stage__script__deleted=False)
     except Task.DoesNotExist:
         return JsonResponse({
             'error': 'Incorrect task id',
         }, status=404)
 
-    task_parameters = Parameter.objects.filter(task=task)
-    if task_parameters:
-        parameter_equal_name = task_parameters.filter(name=name_parameter)
-        if parameter_equal_name:
-            return JsonResponse({
-                'error': 'This name is already in use',
-            }, status=400)
-
-    parameter = Parameter(name=name_parameter, value=value_parameter, task=task)
-    parameter.save()
+    try:
+        with transaction.atomic():
+            parameter = Parameter.objects.create(name=name_parameter, value=value_parameter, task=task)
+            touch_scripts(task.stage.script_id, tasks=[task.id])
+            log_changes((task.stage.script_id, 'parameter', parameter.id, 'create'))
+    except IntegrityError:
+        return JsonResponse({
+            'error': 'This name is already in use',
+        }, status=400)
 
     return JsonResponse({
         'parameter_id': parameter.id,
@@ -635,7 +1118,7 @@ def create_parameter(request):
 @authenticate_user(http_method='POST')
 def save_parameter(request, parameter_id):
     new_name_parameter = request.POST.get('name')
-    new_value_parameter = request.POST.get('value')
+    new_value_parameter = request.POST.get('value', '')
     task_id = request.POST.get('task_id')
 
     if not new_name_parameter or not task_id:
@@ -651,34 +1134,35 @@ def save_parameter(request, parameter_id):
         }, status=400)
 
     try:
-        task = Task.objects.get(id=task_id)
+        task = Task.objects.select_related('stage').get(id=task_id, stage__script__deleted=False)
     except Task.DoesNotExist:
         return JsonResponse({
             'error': 'Incorrect task id',
         }, status=404)
 
     try:
-        parameter = Parameter.objects.get(id=parameter_id)
+        parameter = Parameter.objects.select_related('task__stage').get(
+            id=parameter_id, task__stage__script__deleted=False)
     except Parameter.DoesNotExist:
         return JsonResponse({
             'error': 'Incorrect parameter id',
         }, status=404)
 
-    task_parameters = Parameter.objects.filter(task=task)
-    if task_parameters:
-        try:
-            parameters_equal_name = task_parameters.filter(name=new_name_parameter)
-        except Parameter.DoesNotExist:
-            parameters_equal_name = None
-        if (parameters_equal_name and parameter not in parameters_equal_name) or (parameters_equal_name and parameter in parameters_equal_name and parameters_equal_name.count() > 1):
-            return JsonResponse({
-                'error': 'This name is already in use',
-            }, status=400)
-
+    old_script_id = parameter.task.stage.script_id
+    old_task_id = parameter.task_id
     parameter.name = new_name_parameter
     parameter.value = new_value_parameter
     parameter.task = task
-    parameter.save()
+    try:
+        with transaction.atomic():
+            parameter.save()
+            touch_scripts(old_script_id, task.stage.script_id, tasks=[old_task_id, task.id])
+            log_changes((old_script_id, 'parameter', parameter.id, 'save'),
+                        (task.stage.script_id, 'parameter', parameter.id, 'save'))
+    except IntegrityError:
+        return JsonResponse({
+            'error': 'This name is already in use',
+        }, status=400)
 
     return JsonResponse({
         'parameter_id': parameter.id,
@@ -688,13 +1172,17 @@ def save_parameter(request, parameter_id):
 @authenticate_user(http_method='POST')
 def remove_parameter(request, parameter_id):
     try:
-        parameter = Parameter.objects.get(id=parameter_id)
+        parameter = Parameter.objects.select_related('task__stage').get(
+            id=parameter_id, task__stage__script__deleted=False)
     except Parameter.DoesNotExist:
         return JsonResponse({
             'error': 'Incorrect parameter id',
         }, status=404)
 
-    parameter.delete()
+    with transaction.atomic():
+        delete_trees(Parameter, [parameter.id])
+        touch_scripts(parameter.task.stage.script_id, tasks=[parameter.task_id])
+        log_changes((parameter.task.stage.script_id, 'parameter', parameter_id, 'remove'))
 
     return JsonResponse({
         'parameter_id': parameter_id,
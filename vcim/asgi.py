@@ -0,0 +1,161 @@
+"""ASGI entry point.
+
+Django 2.2 has no async views, so the WSGI application is served from a
+bounded thread pool. Request bodies are received and responses sent on the
+event loop, so a slow client holds a coroutine rather than a worker thread;
+a thread is only taken while a view runs. Streaming responses are produced
+by one thread, which waits while the client is behind.
+"""
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'vcim.settings')
+
+# Size of the queue between a thread producing a streaming response and the
+# coroutine sending it.
+STREAM_QUEUE_SIZE = 8
+
+
+class WSGIToASGI:
+    def __init__(self, wsgi_application, max_workers):
+        self.wsgi_application = wsgi_application
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError('Unsupported ASGI scope type %s' % scope['type'])
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        body = BytesIO()
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.write(message.get('body', b''))
+            more_body = message.get('more_body', False)
+        body.seek(0)
+
+        loop = asyncio.get_event_loop()
+        chunks = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        started = loop.create_future()
+        worker = loop.run_in_executor(
+            self.executor, self.run_application, self.environ(scope, body), loop, started, chunks)
+
+        await asyncio.wait({started, worker}, return_when=asyncio.FIRST_COMPLETED)
+        if not started.done():
+            await worker
+            raise RuntimeError('The WSGI application did not start a response')
+
+        status, headers = started.result()
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': status,
+                'headers': headers,
+            })
+            while True:
+                chunk = await chunks.get()
+                if chunk is None:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        except Exception:
+            # Let the worker thread run to the end of the response.
+            while not worker.done():
+                if await chunks.get() is None:
+                    break
+            raise
+        finally:
+            await worker
+
+    def run_application(self, environ, loop, started, chunks):
+        """Run the WSGI application in a worker thread.
+
+        The response is iterated and closed in this thread, as the database
+        connections it uses belong to the thread.
+        """
+        def start_response(status, headers, exc_info=None):
+            response_headers = [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]
+            loop.call_soon_threadsafe(started.set_result, (int(status.split(' ', 1)[0]), response_headers))
+
+        def put(chunk):
+            asyncio.run_coroutine_threadsafe(chunks.put(chunk), loop).result()
+
+        response = self.wsgi_application(environ, start_response)
+        try:
+            if not getattr(response, 'streaming', True):
+                # The whole body is in memory; hand it over in one go and
+                # free the thread while it is sent.
+                put(response.content)
+            else:
+                for chunk in response:
+                    if chunk:
+                        put(chunk)
+        finally:
+            close = getattr(response, 'close', None)
+            if close is not None:
+                close()
+            put(None)
+
+    def environ(self, scope, body):
+        server_name, server_port = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'],
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+            'SERVER_NAME': server_name,
+            'SERVER_PORT': str(server_port),
+            'SERVER_PROTOCOL': 'HTTP/%s' % scope.get('http_version', '1.1'),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        if scope.get('client'):
+            environ['REMOTE_ADDR'] = scope['client'][0]
+
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin1').upper().replace('-', '_')
+            value = value.decode('latin1')
+            if name == 'CONTENT_TYPE' or name == 'CONTENT_LENGTH':
+                key = name
+            else:
+                key = 'HTTP_%s' % name
+            if key in environ:
+                value = '%s,%s' % (environ[key], value)
+            environ[key] = value
+
+        # The body is buffered, so its length is known even for chunked
+        # requests, and Django reads no form data without it.
+        environ['CONTENT_LENGTH'] = str(len(body.getbuffer()))
+        return environ
+
+
+wsgi_application = get_wsgi_application()
+
+application = WSGIToASGI(wsgi_application, max_workers=settings.ASGI_THREADS)
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -36,6 +37,11 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Per-view timing and query counts in Server-Timing headers and on the
+# metrics endpoint. Opt in with VCIM_INSTRUMENTATION=1.
+if os.environ.get('VCIM_INSTRUMENTATION') == '1':
+    MIDDLEWARE.insert(0, 'api.middleware.InstrumentationMiddleware')
+
 ROOT_URLCONF = 'vcim.urls'
 
 TEMPLATES = [
@@ -57,16 +63,168 @@ TEMPLATES = [
 WSGI_APPLICATION = 'vcim.wsgi.application'
 
 
+# Worker threads running views for the ASGI entry point.
+
+ASGI_THREADS = int(os.environ.get('VCIM_ASGI_THREADS', 16))
+
+
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+# The profile is picked by VCIM_DB_ENGINE: 'sqlite' (default) or 'postgresql'.
+# Connections are kept open for VCIM_DB_CONN_MAX_AGE seconds (0 closes them
+# after every request) and, with CONN_HEALTH_CHECKS, pinged before a request
+# reuses them once they ran no query for DATABASE_HEALTH_CHECK_IDLE seconds.
+# SQLite connections get the SQLITE_PRAGMAS on connect. PostgreSQL needs the
+# packages of requirements-postgresql.txt.
+
+DATABASE_ENGINE = os.environ.get('VCIM_DB_ENGINE', 'sqlite')
+
+if DATABASE_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('VCIM_DB_NAME', 'vcim'),
+            'USER': os.environ.get('VCIM_DB_USER', ''),
+            'PASSWORD': os.environ.get('VCIM_DB_PASSWORD', ''),
+            'HOST': os.environ.get('VCIM_DB_HOST', ''),
+            'PORT': os.environ.get('VCIM_DB_PORT', ''),
+        }
     }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('VCIM_DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+        }
+    }
+
+DATABASES['default'].update({
+    'CONN_MAX_AGE': int(os.environ.get('VCIM_DB_CONN_MAX_AGE', 60)),
+    'CONN_HEALTH_CHECKS': os.environ.get('VCIM_DB_HEALTH_CHECKS', '1') == '1',
+})
+
+DATABASE_HEALTH_CHECK_IDLE = int(os.environ.get('VCIM_DB_HEALTH_CHECK_IDLE', 30))
+
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('VCIM_SQLITE_JOURNAL_MODE', 'wal'),
+    'synchronous': os.environ.get('VCIM_SQLITE_SYNCHRONOUS', 'normal'),
+    'busy_timeout': int(os.environ.get('VCIM_SQLITE_BUSY_TIMEOUT', 5000)),
+}
+
+# Read replicas
+# VCIM_DB_REPLICAS is a comma-separated list of replica hosts, or of database
+# files with SQLite, each added as a 'replicaN' alias with the settings of
+# 'default'. Read-only views query one replica, unless the user called a
+# writing view in the last DATABASE_STICKY_SECONDS. That is tracked in the
+# DATABASE_STICKY_CACHE cache, which must be shared between the processes
+# serving a user; see Cache below. Tests use 'default' for the replicas.
+
+DATABASE_REPLICAS = []
+
+for replica_location in filter(None, os.environ.get('VCIM_DB_REPLICAS', '').split(',')):
+    replica_alias = 'replica%d' % (len(DATABASE_REPLICAS) + 1)
+    DATABASES[replica_alias] = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+    DATABASES[replica_alias]['HOST' if DATABASE_ENGINE == 'postgresql' else 'NAME'] = replica_location.strip()
+    DATABASE_REPLICAS.append(replica_alias)
+
+DATABASE_ROUTERS = ['api.routers.ReplicaRouter']
+
+DATABASE_STICKY_SECONDS = int(os.environ.get('VCIM_DB_STICKY_SECONDS', 5))
+
+DATABASE_STICKY_CACHE = 'sticky'
+
+
+# Largest page a listing view returns, and its page size when the client
+# passes no limit.
+
+API_MAX_PAGE_SIZE = 500
+
+
+# Largest number of operations accepted by one batch request.
+
+BATCH_MAX_OPERATIONS = 1000
+
+
+# Delta exports
+# purgescripts deletes the tombstones of removed jobs after
+# REMOVED_TASK_RETENTION_DAYS days. A delta export from before the pruned
+# tombstones is answered with a full export.
+
+REMOVED_TASK_RETENTION_DAYS = 30
+
+
+# Export jobs
+# Bulk exports run on a pool of EXPORT_JOB_WORKERS threads per process; the
+# job state and the finished archive are kept in the database. A pending or
+# running job whose process stopped updating its heartbeat for
+# EXPORT_JOB_TIMEOUT seconds was lost with that process and is marked
+# failed.
+
+EXPORT_JOB_WORKERS = int(os.environ.get('VCIM_EXPORT_JOB_WORKERS', 4))
+
+EXPORT_JOB_MAX_SCRIPTS = 1000
+
+EXPORT_JOB_TIMEOUT = 600
+
+
+# Change feed
+# A long-poll request waits up to CHANGES_MAX_WAIT seconds, checking the
+# change log every CHANGES_POLL_INTERVAL seconds. An event stream is closed
+# after CHANGES_STREAM_SECONDS and the client reconnects. Both hold a worker
+# thread while they wait, so at most CHANGES_MAX_WAITERS of them wait at a
+# time per process; keep it well below ASGI_THREADS. Beyond that a long poll
+# is answered with 204 and an event stream is closed, both asking the client
+# to come back after CHANGES_RETRY_AFTER seconds. purgescripts deletes the
+# changes older than CHANGELOG_RETENTION_DAYS days, and a cursor from
+# before them is answered with 410.
+
+CHANGES_POLL_INTERVAL = 0.5
+
+CHANGES_MAX_WAIT = 25
+
+CHANGES_STREAM_SECONDS = 30
+
+CHANGES_MAX_WAITERS = int(os.environ.get('VCIM_CHANGES_MAX_WAITERS', 8))
+
+CHANGES_RETRY_AFTER = 5
+
+CHANGELOG_RETENTION_DAYS = 7
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# Rendered exports are keyed by script version, so a shared backend such as
+# memcached can be used by setting VCIM_EXPORT_CACHE_BACKEND and
+# VCIM_EXPORT_CACHE_LOCATION. The local-memory backend evicts the least
+# recently used entries beyond MAX_ENTRIES.
+# The 'sticky' cache is shared by the processes of one host through files by
+# default; set VCIM_STICKY_CACHE_BACKEND and VCIM_STICKY_CACHE_LOCATION to a
+# shared backend such as memcached when several hosts serve the API.
+
+EXPORT_CACHE_BACKEND = os.environ.get(
+    'VCIM_EXPORT_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'exports': {
+        'BACKEND': EXPORT_CACHE_BACKEND,
+        'LOCATION': os.environ.get('VCIM_EXPORT_CACHE_LOCATION', 'vcim-exports'),
+        'TIMEOUT': None,
+    },
+    'sticky': {
+        'BACKEND': os.environ.get(
+            'VCIM_STICKY_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get(
+            'VCIM_STICKY_CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'vcim-sticky')),
+    },
 }
 
+if EXPORT_CACHE_BACKEND.endswith('LocMemCache'):
+    CACHES['exports']['OPTIONS'] = {'MAX_ENTRIES': 1000}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -87,6 +245,18 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# API tokens
+# Tokens issued by the login view. Verified tokens are remembered in-process
+# for API_TOKEN_CACHE_TTL seconds, so a revocation made by another process
+# takes effect here after at most that long.
+
+API_TOKEN_MAX_AGE = 60 * 60 * 24 * 7
+
+API_TOKEN_CACHE_SIZE = 1024
+
+API_TOKEN_CACHE_TTL = 60
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/2.2/topics/i18n/
 